@@ -1,5 +1,30 @@
-```python
 import os
+import re
+import stat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# google-re2 (pip install google-re2) matches in linear time and keeps large
+# alternations cheap; the stdlib engine is used when it isn't installed
+try:
+    import re2 as re_engine
+except ImportError:
+    re_engine = re
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Reads are I/O-bound and release the GIL, so small files are prefetched on
+# a pool while the main thread writes them out in walk order. Larger files
+# are streamed on the main thread instead of being held in memory.
+READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+READ_AHEAD = 64
+PREFETCH_MAX_SIZE = COPY_CHUNK_SIZE
+
+# Classifiers used to bucket ignore patterns at load time
+EXTENSION_PATTERN = re.compile(r'^\*\.[A-Za-z0-9_]+$')
+GLOB_CHARS = re.compile(r'[*?\[]')
+
 
 def load_ignore_patterns(*files):
     """Load patterns from .gitignore and similar files."""
@@ -14,85 +39,236 @@ def load_ignore_patterns(*files):
     return patterns
 
 
-def should_ignore(path, patterns):
-    """Simple pattern matching - covers 90% of use cases."""
-    name = os.path.basename(path)
-    
-    for pattern in patterns:
-        # Exact match
-        if name == pattern.rstrip('/'):
-            return True
-        
-        # Wildcard at start: *.log, *.txt
-        if pattern.startswith('*') and name.endswith(pattern[1:]):
-            return True
-        
-        # Wildcard at end: log*, test*
-        if pattern.endswith('*') and name.startswith(pattern[:-1]):
-            return True
-        
-        # Directory pattern: node_modules/, build/
-        if pattern.endswith('/') and name == pattern[:-1]:
+def _glob_to_regex(glob):
+    """Translate a glob into a regex accepted by both re and RE2.
+
+    fnmatch.translate emits atomic groups that RE2 rejects, so this handles
+    the subset gitignore basenames need: ``*``, ``?`` and ``[...]``.
+    """
+    parts = []
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        i += 1
+        if c == '*':
+            if not parts or parts[-1] != '.*':
+                parts.append('.*')
+        elif c == '?':
+            parts.append('.')
+        elif c == '[':
+            j = i
+            if j < n and glob[j] == '!':
+                j += 1
+            if j < n and glob[j] == ']':
+                j += 1
+            while j < n and glob[j] != ']':
+                j += 1
+            if j >= n:
+                parts.append(re.escape(c))
+                continue
+            stuff = glob[i:j].replace('\\', '\\\\')
+            i = j + 1
+            if stuff.startswith('!'):
+                stuff = '^' + stuff[1:]
+            elif stuff.startswith('^'):
+                stuff = '\\' + stuff
+            parts.append(f'[{stuff}]')
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+
+def _compile_globs(globs):
+    """Compile glob patterns into a predicate over a basename.
+
+    Literal names and plain ``*.ext`` patterns go into a set and a suffix
+    tuple so the common cases are a hash lookup or a C-level endswith;
+    everything else is joined into one regex.
+    """
+    literals = set()
+    suffixes = []
+    alternatives = []
+    for glob in globs:
+        if EXTENSION_PATTERN.match(glob):
+            suffixes.append(glob[1:])
+        elif not GLOB_CHARS.search(glob):
+            literals.add(glob)
+        else:
+            # Anchored once for the whole alternation through fullmatch
+            alternatives.append(f"(?:{_glob_to_regex(glob)})")
+
+    literals = frozenset(literals)
+    suffixes = tuple(suffixes)
+    regex = re_engine.compile("|".join(alternatives)) if alternatives else None
+
+    def matches(name):
+        if name in literals or name.endswith(suffixes):
             return True
-        
-        # Contains pattern: *cache*, *tmp*
-        if pattern.startswith('*') and pattern.endswith('*'):
-            if pattern[1:-1] in name:
-                return True
-    
-    return False
+        return regex is not None and regex.fullmatch(name) is not None
+
+    return matches
+
+
+@lru_cache(maxsize=None)
+def compile_ignore_patterns(patterns):
+    """Compile ignore patterns into a predicate over a basename.
+
+    Directory patterns (``build/``) are matched by name, the same as files.
+    ``!pattern`` re-includes a name, but since ignored directories are
+    never descended into, it only applies inside included directories -
+    the same rule git follows.
+    """
+    ignores, negations = [], []
+    for pattern in patterns:
+        bucket = negations if pattern.startswith('!') else ignores
+        glob = pattern.lstrip('!').rstrip('/')
+        if glob:
+            bucket.append(glob)
+
+    is_ignored = _compile_globs(ignores)
+    is_negated = _compile_globs(negations) if negations else None
+
+    # Names like __init__.py or index.ts repeat across a tree; memoize them
+    @lru_cache(maxsize=100_000)
+    def matches(name):
+        if not is_ignored(name):
+            return False
+        return is_negated is None or not is_negated(name)
+
+    return matches
+
+
+def should_ignore(path, patterns):
+    """Check a path's basename against ignore patterns.
+
+    The patterns are compiled on first use and the matcher is cached, so
+    repeated calls with the same patterns only pay for the match.
+    """
+    return compile_ignore_patterns(tuple(patterns))(os.path.basename(path))
+
+
+def _walk(root, always_skip, matcher, rel=""):
+    """Yield (rel_dir, dir_entries, file_entries) top-down using os.scandir.
+
+    Skipped and ignored directories are pruned before recursing, and the
+    DirEntry type cache is used so no extra stat calls are made. rel_dir
+    is built incrementally and is empty for the root. As with os.walk
+    without followlinks, symlinked directories are listed but not entered.
+    Only regular files (or symlinks to them) are listed as files, so
+    sockets and FIFOs are never opened.
+    """
+    dirs, files = [], []
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir():
+                if entry.name not in always_skip and not matcher(entry.name):
+                    dirs.append(entry)
+            elif entry.is_file():
+                files.append(entry)
+
+    yield rel, dirs, files
+
+    for entry in dirs:
+        if entry.is_symlink():
+            continue
+        child_rel = f"{rel}/{entry.name}" if rel else entry.name
+        yield from _walk(entry.path, always_skip, matcher, child_rel)
+
+
+def _read_bytes(path):
+    """Read a small file whole; return None if it should be streamed."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > PREFETCH_MAX_SIZE:
+            return None
+        return f.read()
+
+
+def _iter_sections(root_dir, output_file, always_skip, matcher):
+    """Yield (header_bytes, file_path) in walk order; file_path is None for directories."""
+    for rel_dir, _, file_entries in _walk(root_dir, always_skip, matcher):
+        yield f"\n📂 {rel_dir or root_dir}\n{'-' * 40}\n".encode("utf-8"), None
+
+        for entry in file_entries:
+            # Skip the dumper script and output file
+            if entry.name in {'dumper.py', output_file}:
+                continue
+
+            # Skip ignored files
+            if matcher(entry.name):
+                continue
+
+            rel_file = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            yield f"\n--- {rel_file} ---\n".encode("utf-8"), entry.path
+
+
+def _stream_file(path, out, view):
+    """Copy a large file into out, using sendfile(2) where the OS allows it."""
+    with open(path, "rb", buffering=0) as f:
+        st = os.fstat(f.fileno())
+        if hasattr(os, "sendfile") and stat.S_ISREG(st.st_mode):
+            # Kernel-side copy; out must be flushed so bytes land in order
+            out.flush()
+            offset = 0
+            try:
+                while offset < st.st_size:
+                    sent = os.sendfile(out.fileno(), f.fileno(), offset, st.st_size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                if offset:
+                    raise
+                # Not supported for this pair of files; copy in userspace
+
+        # Reused buffer instead of per-chunk bytes objects
+        while n := f.readinto(view):
+            out.write(view[:n])
+
+
+def _write_section(out, header, path, future, view):
+    out.write(header)
+    if future is None:
+        return
+    try:
+        data = future.result()
+        if data is None:
+            _stream_file(path, out, view)
+        else:
+            out.write(data)
+    except Exception as e:
+        out.write(f"[Could not read: {e}]\n".encode("utf-8"))
 
 
 def dump_project(root_dir=".", output_file="project_dump.txt"):
     # Load ignore patterns
     gitignore = os.path.join(root_dir, ".gitignore")
     gcloudignore = os.path.join(root_dir, ".gcloudignore")
-    patterns = load_ignore_patterns(gitignore, gcloudignore)
-    
+    matcher = compile_ignore_patterns(tuple(load_ignore_patterns(gitignore, gcloudignore)))
+
     # Hard-coded excludes that are always skipped
     always_skip = {
         '.git', '__pycache__', '.venv', 'venv', 'node_modules',
         '.expo', 'build', 'dist', '.next', '.cache'
     }
-    
-    with open(output_file, "w", encoding="utf-8", errors="ignore") as out:
-        for dirpath, dirnames, filenames in os.walk(root_dir):
-            # Skip directories IN-PLACE so os.walk doesn't enter them
-            dirnames[:] = [
-                d for d in dirnames 
-                if d not in always_skip and not should_ignore(d, patterns)
-            ]
-            
-            rel_path = os.path.relpath(dirpath, root_dir)
-            if rel_path == ".":
-                rel_path = root_dir
-            
-            out.write(f"\n📂 {rel_path}\n")
-            out.write("-" * 40 + "\n")
-            
-            for filename in filenames:
-                # Skip the dumper script and output file
-                if filename in {'dumper.py', output_file}:
-                    continue
-                
-                # Skip ignored files
-                if should_ignore(filename, patterns):
-                    continue
-                
-                file_path = os.path.join(dirpath, filename)
-                rel_file = os.path.relpath(file_path, root_dir)
-                
-                out.write(f"\n--- {rel_file} ---\n")
-                try:
-                    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                        out.write(f.read())
-                except Exception as e:
-                    out.write(f"[Could not read: {e}]\n")
-    
+
+    # Output is binary so file contents can be streamed without decoding.
+    # At most READ_AHEAD reads are in flight; sections are written in the
+    # order they were submitted so the dump stays deterministic.
+    with open(output_file, "wb") as out, ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+        pending = deque()
+        view = memoryview(bytearray(COPY_CHUNK_SIZE))
+        for header, path in _iter_sections(root_dir, output_file, always_skip, matcher):
+            future = pool.submit(_read_bytes, path) if path is not None else None
+            pending.append((header, path, future))
+            if len(pending) >= READ_AHEAD:
+                _write_section(out, *pending.popleft(), view)
+
+        while pending:
+            _write_section(out, *pending.popleft(), view)
+
     print(f"✅ Done: {output_file}")
 
 
 if __name__ == "__main__":
     dump_project()
-
-```
@@ -29,6 +29,8 @@ class Settings(BaseSettings):
     # OCR & NLP
     spacy_model: str = "en_core_web_sm"
     ocr_confidence_threshold: float = 0.7
+    max_concurrent_processing: int = 4
+    processing_queue_timeout_seconds: float = 5.0
     
     class Config:
         env_file = ".env"
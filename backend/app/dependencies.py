@@ -0,0 +1,179 @@
+# backend/app/dependencies.py
+from fastapi import HTTPException, Depends, Request, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from firebase_admin import auth as firebase_auth
+from cachetools import TTLCache
+from typing import Dict, Any
+import asyncio
+import hashlib
+from functools import partial
+import logging
+import time
+import jwt
+
+from app.config import settings
+from app.services.firestore_service import FirestoreService
+from app.services.ocr_service import OCRService
+from app.services.nlp_service import NLPService
+
+logger = logging.getLogger(__name__)
+security = HTTPBearer()
+
+# -------- Local ID token verification --------
+# Firebase ID tokens are RS256 JWTs signed with Google's securetoken keys.
+# The key set rotates every few hours at most, so it is fetched once and
+# kept for six hours; verification is then local signature and claim checks.
+FIREBASE_JWKS_URL = "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+JWKS_CACHE_SECONDS = 6 * 60 * 60
+_jwks_client = jwt.PyJWKClient(FIREBASE_JWKS_URL, cache_jwk_set=True, lifespan=JWKS_CACHE_SECONDS)
+
+
+def _verify_id_token_locally(token: str) -> Dict[str, Any]:
+    """Verify a Firebase ID token against the cached JWKS.
+
+    Raises jwt.ExpiredSignatureError or another jwt.PyJWTError on failure.
+    Unlike auth.verify_id_token(check_revoked=True), revocation is not checked.
+    """
+    signing_key = _jwks_client.get_signing_key_from_jwt(token)
+    decoded = jwt.decode(
+        token,
+        signing_key.key,
+        algorithms=["RS256"],
+        audience=settings.firebase_project_id,
+        issuer=f"https://securetoken.google.com/{settings.firebase_project_id}",
+        options={"require": ["exp", "iat", "sub"]},
+    )
+    if not decoded.get("sub"):
+        raise jwt.InvalidTokenError("Token has an empty subject")
+    # firebase_admin exposes the subject as uid; keep callers unchanged
+    decoded["uid"] = decoded["sub"]
+    return decoded
+
+# -------- Dependency: Firestore service --------
+async def get_firestore_service(request: Request) -> FirestoreService:
+    """Return the shared FirestoreService created at startup"""
+    return request.app.state.firestore
+
+
+# -------- Dependencies: document processing services --------
+async def get_ocr_service(request: Request) -> OCRService:
+    """Return the shared OCRService created at startup"""
+    return request.app.state.ocr
+
+
+async def get_nlp_service(request: Request) -> NLPService:
+    """Return the shared NLPService created at startup"""
+    return request.app.state.nlp
+
+
+# -------- Verified token cache --------
+# Verifying a Firebase ID token means an RSA signature check and, now and
+# then, a fetch of Google's public keys. Clients resend the same token for
+# up to an hour, so decoded tokens are kept for a few minutes, keyed by a
+# hash so raw tokens are never held in memory.
+TOKEN_CACHE_TTL_SECONDS = 300
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Verifications in progress, so a burst of requests carrying the same new
+# token shares one verification instead of each starting its own
+_inflight_verifications: Dict[str, asyncio.Task] = {}
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _finish_verification(key: str, task: asyncio.Task) -> None:
+    """Cache a successful verification and stop sharing the finished task"""
+    if _inflight_verifications.get(key) is task:
+        del _inflight_verifications[key]
+    # exception() also marks a failure retrieved, so it is not logged as unhandled
+    if not task.cancelled() and task.exception() is None:
+        _token_cache[key] = task.result()
+
+
+async def verify_id_token_cached(token: str) -> Dict[str, Any]:
+    """Verify a Firebase ID token, reusing a recent successful verification.
+
+    Raises jwt.PyJWTError subclasses on failure. A key set refresh is a
+    blocking fetch, so verification runs in a worker thread. It runs as a
+    task of its own that every caller awaits through a shield, so a caller
+    that is cancelled, e.g. by a client disconnect, does not cancel it for
+    the others.
+    """
+    key = _token_key(token)
+    decoded = _token_cache.get(key)
+    if decoded is not None:
+        # The cache TTL can outlive the token itself
+        if decoded.get("exp", 0) > time.time():
+            return decoded
+        _token_cache.pop(key, None)
+
+    task = _inflight_verifications.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_verify_id_token_locally, token))
+        task.add_done_callback(partial(_finish_verification, key))
+        _inflight_verifications[key] = task
+    return await asyncio.shield(task)
+
+
+def invalidate_cached_token(token: str) -> None:
+    """Drop a token from the cache, e.g. after its refresh tokens are revoked."""
+    _token_cache.pop(_token_key(token), None)
+
+
+# -------- Dependency: Current user (verify Firebase token) --------
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Dict[str, Any]:
+    """Verify Firebase ID token and return decoded token"""
+    token = credentials.credentials
+    try:
+        decoded = await verify_id_token_cached(token)
+        return {
+            "uid": decoded.get("uid"),
+            "email": decoded.get("email"),
+            "email_verified": decoded.get("email_verified", False),
+            "token_data": decoded,
+        }
+    except jwt.ExpiredSignatureError:
+        logger.info("Expired Firebase token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication token expired")
+    except jwt.InvalidTokenError:
+        logger.info("Invalid Firebase token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token")
+    except Exception as e:
+        logger.error("Token verification failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token verification failed")
+
+
+# -------- Dependency: Current user, checked against revocation --------
+async def get_current_user_checked(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Dict[str, Any]:
+    """Verify a Firebase ID token with firebase_admin, including revocation.
+
+    Costs a call to the Auth backend, so it is only used by sensitive
+    endpoints such as logout and account deletion; it bypasses the cache.
+    """
+    token = credentials.credentials
+    try:
+        decoded = await asyncio.to_thread(firebase_auth.verify_id_token, token, check_revoked=True)
+        return {
+            "uid": decoded.get("uid"),
+            "email": decoded.get("email"),
+            "email_verified": decoded.get("email_verified", False),
+            "token_data": decoded,
+        }
+    except firebase_auth.RevokedIdTokenError:
+        logger.info("Revoked Firebase token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication token revoked")
+    except firebase_auth.ExpiredIdTokenError:
+        logger.info("Expired Firebase token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication token expired")
+    except firebase_auth.InvalidIdTokenError:
+        logger.info("Invalid Firebase token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token")
+    except Exception as e:
+        logger.error("Token verification failed: %s", e)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token verification failed")
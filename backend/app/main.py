@@ -2,7 +2,7 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import firebase_admin
 from firebase_admin import credentials
 import uvicorn
@@ -11,6 +11,8 @@ import logging
 from app.config import settings
 from app.routes import health_records, upload, auth
 from app.services.firestore_service import FirestoreService
+from app.services.ocr_service import OCRService
+from app.services.nlp_service import NLPService
 
 # Configure logging
 logging.basicConfig(
@@ -35,6 +37,7 @@ app = FastAPI(
     debug=settings.debug,
     docs_url="/docs" if settings.debug else None,
     redoc_url="/redoc" if settings.debug else None,
+    default_response_class=ORJSONResponse,
 )
 
 # Add middleware
@@ -47,11 +50,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One Firestore client per process; it pools its own gRPC channels and is
+# safe to share across concurrent requests
+@app.on_event("startup")
+async def create_firestore_service():
+    app.state.firestore = FirestoreService()
+
+# The Vision client and the spaCy model are likewise built once, not per upload
+@app.on_event("startup")
+async def create_document_services():
+    app.state.ocr = OCRService()
+    app.state.nlp = NLPService()
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     logger.error(f"Global exception: {str(exc)}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"detail": "Internal server error", "error": str(exc) if settings.debug else None}
     )
@@ -62,8 +77,7 @@ async def health_check():
     """Health check endpoint"""
     try:
         # Test Firestore connection
-        firestore_service = FirestoreService()
-        await firestore_service.test_connection()
+        await app.state.firestore.test_connection()
         
         return {
             "status": "healthy",
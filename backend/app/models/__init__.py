@@ -1,9 +1,9 @@
 from .user import User, UserCreate, UserUpdate
-from .health_record import HealthRecord, HealthRecordCreate, Biomarker
-from .upload import DocumentUpload, ProcessingResult
+from .health_record import (
+    HealthRecord, HealthRecordCreate, HealthRecordUpdate, Biomarker, BiomarkerReading
+)
 
 __all__ = [
     "User", "UserCreate", "UserUpdate",
-    "HealthRecord", "HealthRecordCreate", "Biomarker",
-    "DocumentUpload", "ProcessingResult"
+    "HealthRecord", "HealthRecordCreate", "HealthRecordUpdate", "Biomarker", "BiomarkerReading"
 ]
@@ -1,68 +1,101 @@
 # backend/app/models/health_record.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
 
 
 class Biomarker(BaseModel):
     """Individual biomarker reading with its value, unit, normal range, and status."""
-    name: str = Field(..., example="hemoglobin")
-    value: Optional[float] = Field(None, example=13.5)
-    unit: Optional[str] = Field(None, example="g/dL")
-    range: Optional[str] = Field(None, example="12.0-16.0")
-    status: Optional[str] = Field(None, example="normal")
+    name: str = Field(..., json_schema_extra={"example": "hemoglobin"})
+    value: Optional[float] = Field(None, json_schema_extra={"example": 13.5})
+    unit: Optional[str] = Field(None, json_schema_extra={"example": "g/dL"})
+    range: Optional[str] = Field(None, json_schema_extra={"example": "12.0-16.0"})
+    status: Optional[str] = Field(None, json_schema_extra={"example": "normal"})
+
+
+class BiomarkerReading(BaseModel):
+    """A biomarker reading as stored in a record's biomarkers map, keyed by name."""
+    value: Optional[float] = Field(None, json_schema_extra={"example": 13.5})
+    unit: Optional[str] = Field(None, json_schema_extra={"example": "g/dL"})
+    range: Optional[str] = Field(None, json_schema_extra={"example": "12.0-16.0"})
+    status: Optional[str] = Field(None, json_schema_extra={"example": "normal"})
+
+    model_config = ConfigDict(extra="allow")
 
 
 class ProcessingMetadata(BaseModel):
     """Metadata about OCR/NLP or document processing pipeline."""
-    ocr_pages: Optional[int] = Field(0, example=1)
-    ocr_blocks: Optional[int] = Field(0, example=15)
-    nlp_entities_found: Optional[int] = Field(0, example=5)
+    ocr_pages: Optional[int] = Field(0, json_schema_extra={"example": 1})
+    ocr_blocks: Optional[int] = Field(0, json_schema_extra={"example": 15})
+    nlp_entities_found: Optional[int] = Field(0, json_schema_extra={"example": 5})
     processed_at: Optional[str] = Field(
-        default_factory=lambda: datetime.utcnow().isoformat() + "Z"
+        default_factory=_utc_now_iso
     )
 
 
 class HealthRecordBase(BaseModel):
     """Common fields for health records."""
-    date: str = Field(..., example="2025-10-08")
-    type: str = Field(..., example="Lipid Panel")
-    facility: Optional[str] = Field(None, example="Apollo Diagnostics")
+    date: str = Field(..., json_schema_extra={"example": "2025-10-08"})
+    type: str = Field(..., json_schema_extra={"example": "Lipid Panel"})
+    facility: Optional[str] = Field(None, json_schema_extra={"example": "Apollo Diagnostics"})
     biomarkers: Optional[Dict[str, Any]] = Field(
         default_factory=dict,
-        example={"cholesterol": {"value": 180, "unit": "mg/dL", "status": "normal"}},
+        json_schema_extra={"example": {"cholesterol": {"value": 180, "unit": "mg/dL", "status": "normal"}}},
     )
-    original_document: Optional[str] = Field(None, example="lipid_report.pdf")
-    document_url: Optional[str] = Field(None, example="gs://jiva-health/documents/uid/abc123.pdf")
+    original_document: Optional[str] = Field(None, json_schema_extra={"example": "lipid_report.pdf"})
     ocr_confidence: Optional[float] = Field(0.0, ge=0, le=1)
     processing_metadata: Optional[ProcessingMetadata] = Field(default_factory=ProcessingMetadata)
 
 
 class HealthRecordCreate(HealthRecordBase):
-    """Schema for creating a new health record."""
-    user_id: Optional[str] = Field(None, example="firebase-uid-123")
-    created_at: Optional[str] = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    updated_at: Optional[str] = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    """Request body for creating a health record; owner and timestamps are set by the server."""
+    date: Optional[str] = Field(None, json_schema_extra={"example": "2025-10-08"})
+    facility: str = Field(..., json_schema_extra={"example": "Apollo Diagnostics"})
+    biomarkers: Dict[str, BiomarkerReading] = Field(
+        ...,
+        json_schema_extra={"example": {"cholesterol": {"value": 180, "unit": "mg/dL", "status": "normal"}}},
+    )
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class HealthRecordUpdate(BaseModel):
+    """Request body for updating a health record; unknown and server-set fields are dropped."""
+    date: Optional[str] = None
+    type: Optional[str] = None
+    facility: Optional[str] = None
+    biomarkers: Optional[Dict[str, BiomarkerReading]] = None
+    original_document: Optional[str] = None
+    ocr_confidence: Optional[float] = Field(None, ge=0, le=1)
+
+    model_config = ConfigDict(extra="ignore")
 
 
 class HealthRecord(HealthRecordBase):
     """Full health record stored in Firestore."""
-    id: Optional[str] = Field(None, example="record123")
-    user_id: str = Field(..., example="firebase-uid-123")
-    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    updated_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
+    id: Optional[str] = Field(None, json_schema_extra={"example": "record123"})
+    user_id: str = Field(..., json_schema_extra={"example": "firebase-uid-123"})
+    # Set by the upload route only; it names the object deleted with the record
+    document_url: Optional[str] = Field(None, json_schema_extra={"example": "gs://jiva-health/documents/uid/abc123.pdf"})
+    created_at: str = Field(default_factory=_utc_now_iso)
+    updated_at: str = Field(default_factory=_utc_now_iso)
+    status: Optional[str] = Field(None, json_schema_extra={"example": "completed"})
     deleted: Optional[bool] = Field(False)
     deleted_at: Optional[str] = None
-    account_status: Optional[str] = Field(None, example="active")
+    account_status: Optional[str] = Field(None, json_schema_extra={"example": "active"})
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
 
 
 class HealthRecordListResponse(BaseModel):
     """Response schema for multiple health records."""
     records: List[HealthRecord]
     count: int
+    has_more: bool = False
     next_cursor: Optional[str] = None
 
 
@@ -1,21 +1,26 @@
  
 from fastapi import APIRouter, HTTPException, Depends, Body
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.security import HTTPAuthorizationCredentials
 from firebase_admin import auth
+import asyncio
 import logging
+import time
 from typing import Optional, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 
+from app.dependencies import security, get_firestore_service, get_current_user, get_current_user_checked, invalidate_cached_token
 from app.services.firestore_service import FirestoreService
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-security = HTTPBearer()
 
-# Dependencies
-async def get_firestore_service():
-    return FirestoreService()
+# Profile fields clients may not change, and those needed for a complete profile
+PROFILE_PROTECTED_FIELDS = frozenset({'id', 'email', 'uid', 'created_at'})
+PROFILE_REQUIRED_FIELDS = ('name', 'phone')
+
+# Profile fields read by /user-stats
+USER_STATS_FIELDS = ['created_at', 'profile_completed', 'last_login', 'updated_at']
 
 @router.post("/register")
 async def register_user(
@@ -35,7 +40,7 @@ async def register_user(
         
         # Verify the user exists in Firebase Auth
         try:
-            firebase_user = auth.get_user(uid)
+            firebase_user = await asyncio.to_thread(auth.get_user, uid)
         except auth.UserNotFoundError:
             raise HTTPException(status_code=404, detail="User not found in Firebase")
         
@@ -45,6 +50,7 @@ async def register_user(
             raise HTTPException(status_code=400, detail="User profile already exists")
         
         # Create user profile in Firestore
+        now = datetime.now(timezone.utc)
         profile_data = {
             'id': uid,
             'email': email,
@@ -55,15 +61,15 @@ async def register_user(
             'allergies': user_data.get('allergies', []),
             'chronic_conditions': user_data.get('chronic_conditions', []),
             'emergency_contact': user_data.get('emergency_contact'),
-            'created_at': datetime.utcnow().isoformat(),
-            'updated_at': datetime.utcnow().isoformat(),
+            'created_at': now,
+            'updated_at': now,
             'profile_completed': bool(name and phone),
-            'last_login': datetime.utcnow().isoformat()
+            'last_login': now
         }
         
         await firestore_service.create_user_profile(uid, profile_data)
         
-        logger.info(f"User profile created for UID: {uid}")
+        logger.info("User profile created for UID: %s", uid)
         
         return {
             "success": True,
@@ -79,27 +85,25 @@ async def register_user(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error creating user profile: {e}")
+        logger.error("Error creating user profile: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create user profile")
 
 @router.post("/login")
 async def login_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Login user (verify token and update last login)"""
     try:
-        # Verify Firebase ID token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # Get user profile
         user_profile = await firestore_service.get_user_profile(uid)
         
         if not user_profile:
             # If profile doesn't exist, create a minimal one
-            firebase_user = auth.get_user(uid)
+            firebase_user = await asyncio.to_thread(auth.get_user, uid)
+            now = datetime.now(timezone.utc)
             profile_data = {
                 'id': uid,
                 'email': firebase_user.email,
@@ -107,20 +111,22 @@ async def login_user(
                 'phone': firebase_user.phone_number or '',
                 'allergies': [],
                 'chronic_conditions': [],
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
+                'created_at': now,
+                'updated_at': now,
                 'profile_completed': False,
-                'last_login': datetime.utcnow().isoformat()
+                'last_login': now
             }
             await firestore_service.create_user_profile(uid, profile_data)
             user_profile = profile_data
         else:
             # Update last login
+            now = datetime.now(timezone.utc)
             await firestore_service.update_user_profile(uid, {
-                'last_login': datetime.utcnow().isoformat()
+                'last_login': now,
+                'updated_at': now
             })
         
-        logger.info(f"User logged in: {uid}")
+        logger.info("User logged in: %s", uid)
         
         return {
             "success": True,
@@ -128,64 +134,54 @@ async def login_user(
             "data": {
                 "user": user_profile,
                 "token_valid": True,
-                "expires_in": decoded_token.get('exp', 0) - int(datetime.utcnow().timestamp())
+                "expires_in": current_user['token_data'].get('exp', 0) - int(time.time())
             }
         }
         
-    except auth.InvalidIdTokenError:
-        logger.warning("Invalid ID token provided")
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
-    except auth.ExpiredIdTokenError:
-        logger.warning("Expired ID token provided")
-        raise HTTPException(status_code=401, detail="Authentication token expired")
     except Exception as e:
-        logger.error(f"Error during login: {e}")
+        logger.error("Error during login: %s", e)
         raise HTTPException(status_code=500, detail="Login failed")
 
 @router.post("/logout")
 async def logout_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user_checked),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Logout user (revoke token and update logout time)"""
     try:
-        # Verify token first
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # Revoke refresh tokens for the user
-        auth.revoke_refresh_tokens(uid)
+        await asyncio.to_thread(auth.revoke_refresh_tokens, uid)
+        invalidate_cached_token(credentials.credentials)
         
         # Update user profile with logout time
+        now = datetime.now(timezone.utc)
         await firestore_service.update_user_profile(uid, {
-            'last_logout': datetime.utcnow().isoformat()
+            'last_logout': now,
+            'updated_at': now
         })
         
-        logger.info(f"User logged out: {uid}")
+        logger.info("User logged out: %s", uid)
         
         return {
             "success": True,
             "message": "Logout successful"
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
     except Exception as e:
-        logger.error(f"Error during logout: {e}")
+        logger.error("Error during logout: %s", e)
         raise HTTPException(status_code=500, detail="Logout failed")
 
 @router.get("/profile")
 async def get_user_profile(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Get current user profile"""
     try:
-        # Verify token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # Get user profile
         user_profile = await firestore_service.get_user_profile(uid)
@@ -198,52 +194,33 @@ async def get_user_profile(
             "data": user_profile
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting user profile: {e}")
+        logger.error("Error getting user profile: %s", e)
         raise HTTPException(status_code=500, detail="Failed to get user profile")
 
 @router.put("/profile")
 async def update_user_profile(
     update_data: Dict[str, Any] = Body(...),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Update user profile"""
     try:
-        # Verify token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # Remove fields that shouldn't be updated
-        protected_fields = ['id', 'email', 'uid', 'created_at']
-        for field in protected_fields:
-            update_data.pop(field, None)
-        
-        # Add updated timestamp
-        update_data['updated_at'] = datetime.utcnow().isoformat()
-        
-        # Check if profile is now complete
-        required_fields = ['name', 'phone']
-        current_profile = await firestore_service.get_user_profile(uid)
-        if current_profile:
-            profile_completed = all(
-                update_data.get(field) or current_profile.get(field) 
-                for field in required_fields
-            )
-            update_data['profile_completed'] = profile_completed
-        
-        # Update user profile
-        await firestore_service.update_user_profile(uid, update_data)
+        update_data = {k: v for k, v in update_data.items() if k not in PROFILE_PROTECTED_FIELDS}
         
-        # Get updated profile
-        updated_profile = await firestore_service.get_user_profile(uid)
+        # Completion is computed against the current (usually cached) profile
+        updated_profile = await firestore_service.update_user_profile_with_completion(
+            uid, update_data, required_fields=PROFILE_REQUIRED_FIELDS
+        )
+        if updated_profile is None:
+            raise HTTPException(status_code=404, detail="User profile not found")
         
-        logger.info(f"User profile updated: {uid}")
+        logger.info("User profile updated: %s", uid)
         
         return {
             "success": True,
@@ -251,20 +228,19 @@ async def update_user_profile(
             "data": updated_profile
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error updating user profile: {e}")
+        logger.error("Error updating user profile: %s", e)
         raise HTTPException(status_code=500, detail="Failed to update user profile")
 
 @router.post("/verify-token")
 async def verify_token(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """Verify if the provided token is valid"""
     try:
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = current_user['token_data']
         
         return {
             "success": True,
@@ -278,24 +254,17 @@ async def verify_token(
             }
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
-    except auth.ExpiredIdTokenError:
-        raise HTTPException(status_code=401, detail="Authentication token expired")
     except Exception as e:
-        logger.error(f"Error verifying token: {e}")
+        logger.error("Error verifying token: %s", e)
         raise HTTPException(status_code=500, detail="Token verification failed")
 
 @router.post("/refresh-token")
 async def refresh_token(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """Refresh user token (this is typically handled client-side by Firebase SDK)"""
     try:
-        # Verify current token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # In Firebase, token refresh is handled client-side
         # This endpoint can be used to verify the refreshed token
@@ -308,24 +277,19 @@ async def refresh_token(
             }
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
     except Exception as e:
-        logger.error(f"Error in refresh token endpoint: {e}")
+        logger.error("Error in refresh token endpoint: %s", e)
         raise HTTPException(status_code=500, detail="Token refresh failed")
 
 @router.delete("/account")
 async def delete_user_account(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user_checked),
     firestore_service: FirestoreService = Depends(get_firestore_service),
     confirmation: Dict[str, str] = Body(...)
 ):
     """Delete user account (soft delete - mark as deleted)"""
     try:
-        # Verify token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
         # Check confirmation
         if confirmation.get('confirm_delete') != 'DELETE_MY_ACCOUNT':
@@ -335,57 +299,58 @@ async def delete_user_account(
             )
         
         # Soft delete user profile
+        now = datetime.now(timezone.utc)
         await firestore_service.update_user_profile(uid, {
             'deleted': True,
-            'deleted_at': datetime.utcnow().isoformat(),
+            'deleted_at': now,
+            'updated_at': now,
             'account_status': 'deleted'
         })
         
         # Soft delete all user's health records
-        user_records = await firestore_service.get_user_health_records(uid, limit=1000)
-        for record in user_records:
-            await firestore_service.delete_health_record(record['id'])
+        async for record_ids in firestore_service.stream_user_record_ids(uid):
+            await firestore_service.bulk_soft_delete_health_records(record_ids)
+        await firestore_service.delete_health_stats(uid)
+        await firestore_service.delete_user_ocr_cache(uid)
         
-        logger.info(f"User account soft deleted: {uid}")
+        logger.info("User account soft deleted: %s", uid)
         
         return {
             "success": True,
             "message": "Account deleted successfully. Your data has been marked for deletion."
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error deleting user account: {e}")
+        logger.error("Error deleting user account: %s", e)
         raise HTTPException(status_code=500, detail="Failed to delete account")
 
 @router.get("/user-stats")
 async def get_user_statistics(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Get user account statistics"""
     try:
-        # Verify token
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
-        uid = decoded_token['uid']
+        uid = current_user['uid']
         
-        # Get user profile
-        user_profile = await firestore_service.get_user_profile(uid)
+        # Profile and a server-side record count, fetched concurrently
+        stats = await firestore_service.get_user_stats_bundle(uid, profile_fields=USER_STATS_FIELDS)
+        user_profile = stats['profile']
         if not user_profile:
             raise HTTPException(status_code=404, detail="User profile not found")
         
-        # Get health records count
-        health_records = await firestore_service.get_user_health_records(uid, limit=1000)
-        
         # Calculate statistics
         account_age_days = 0
-        if user_profile.get('created_at'):
-            created_date = datetime.fromisoformat(user_profile['created_at'].replace('Z', '+00:00'))
-            account_age_days = (datetime.utcnow() - created_date.replace(tzinfo=None)).days
+        created_date = user_profile.get('created_at')
+        if isinstance(created_date, str):
+            # Profiles written before created_at was stored as a timestamp
+            created_date = datetime.fromisoformat(created_date.replace('Z', '+00:00'))
+        if created_date:
+            if created_date.tzinfo is None:
+                created_date = created_date.replace(tzinfo=timezone.utc)
+            account_age_days = (datetime.now(timezone.utc) - created_date).days
         
         return {
             "success": True,
@@ -393,16 +358,14 @@ async def get_user_statistics(
                 "account_created": user_profile.get('created_at'),
                 "account_age_days": account_age_days,
                 "profile_completed": user_profile.get('profile_completed', False),
-                "total_health_records": len(health_records),
+                "total_health_records": stats['record_count'],
                 "last_login": user_profile.get('last_login'),
                 "last_activity": user_profile.get('updated_at')
             }
         }
         
-    except auth.InvalidIdTokenError:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting user statistics: {e}")
+        logger.error("Error getting user statistics: %s", e)
         raise HTTPException(status_code=500, detail="Failed to get user statistics")
@@ -1,59 +1,71 @@
 # backend/app/routes/health_records.py
-from fastapi import APIRouter, HTTPException, Depends, Body, Query, BackgroundTasks, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth as firebase_auth
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, BackgroundTasks, status
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import datetime, timezone
+import asyncio
+import base64
+import hashlib
+import json
 import logging
+from google.api_core.exceptions import FailedPrecondition
 
+from app.dependencies import get_current_user, get_firestore_service
+from app.models.health_record import HealthRecordCreate, HealthRecordUpdate
 from app.services.firestore_service import FirestoreService
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Health Records"])
-security = HTTPBearer()
 
 
-# -------- Dependency: Firestore service factory --------
-async def get_firestore_service() -> FirestoreService:
-    """Return a FirestoreService instance"""
-    return FirestoreService()
+# -------- Helpers: list cursors --------
+def encode_cursor(record: Dict[str, Any]) -> str:
+    """Opaque page token for the record a page ended on"""
+    payload = json.dumps({"created_at": record.get("created_at"), "id": record["id"]})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
 
 
-# -------- Dependency: Current user (verify Firebase token) --------
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> Dict[str, Any]:
-    """Verify Firebase ID token and return decoded token"""
-    token = credentials.credentials
+def decode_cursor(token: str) -> Dict[str, str]:
     try:
-        decoded = firebase_auth.verify_id_token(token)
-        return {
-            "uid": decoded.get("uid"),
-            "email": decoded.get("email"),
-            "email_verified": decoded.get("email_verified", False),
-            "token_data": decoded,
-        }
-    except firebase_auth.ExpiredIdTokenError:
-        logger.info("Expired Firebase token")
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication token expired")
-    except firebase_auth.InvalidIdTokenError:
-        logger.info("Invalid Firebase token")
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token")
-    except Exception as e:
-        logger.error(f"Token verification failed: {e}")
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token verification failed")
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if not isinstance(cursor, dict) or not cursor.get("created_at") or not cursor.get("id"):
+            raise ValueError(token)
+        return cursor
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# -------- Helpers: conditional GETs --------
+# Clients poll these endpoints; a matching If-None-Match gets a bodiless 304.
+# "no-cache" makes clients revalidate every time rather than reuse blindly.
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
 
 
 # -------- Helper: standardize timestamps --------
 def now_iso() -> str:
-    return datetime.utcnow().isoformat() + "Z"
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
 
 # -------- Routes --------
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_health_record(
-    record: Dict[str, Any] = Body(...),
+    record: HealthRecordCreate,
     background_tasks: BackgroundTasks = None,
     current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
@@ -64,22 +76,23 @@ async def create_health_record(
         if not uid:
             raise HTTPException(status_code=401, detail="User authentication required")
 
-        # Normalize and protect fields
-        record_payload = dict(record)
+        # Only fields the client actually sent; owner and timestamps are ours
+        ts = now_iso()
+        record_payload = record.model_dump(exclude_unset=True)
         record_payload["user_id"] = uid
-        record_payload.setdefault("date", datetime.utcnow().strftime("%Y-%m-%d"))
-        record_payload["created_at"] = now_iso()
-        record_payload["updated_at"] = now_iso()
+        if not record_payload.get("date"):
+            record_payload["date"] = ts[:10]
+        record_payload["created_at"] = ts
+        record_payload["updated_at"] = ts
 
-        # Persist to Firestore
-        record_id = await firestore_service.create_health_record(record_payload)
-        created = await firestore_service.get_health_record(record_id)
+        # The service returns the record as stored, so no re-read
+        created = await firestore_service.create_health_record(record_payload)
 
         return {
             "success": True,
             "message": "Health record created",
             "data": {
-                "record_id": record_id,
+                "record_id": created["id"],
                 "record": created
             }
         }
@@ -87,14 +100,17 @@ async def create_health_record(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error creating health record: {e}")
+        logger.error("Error creating health record: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create health record")
 
 
 @router.get("/", status_code=status.HTTP_200_OK)
 async def list_health_records(
+    request: Request,
+    response: Response,
     limit: int = Query(20, gt=0, le=100),
     cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
     current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
@@ -104,27 +120,78 @@ async def list_health_records(
         if not uid:
             raise HTTPException(status_code=401, detail="User authentication required")
 
-        records = await firestore_service.get_user_health_records(uid, limit=limit, cursor=cursor)
+        # created_at is always projected; the next page cursor is built from it
+        projection = None
+        if fields:
+            projection = sorted({f.strip() for f in fields.split(",") if f.strip()} | {"created_at"})
+
+        # One record past the page tells whether another page exists
+        page_args = {"limit": limit + 1, "cursor": decode_cursor(cursor) if cursor else None, "fields": projection}
+
+        # Any write to the user's records moves the latest updated_at or the
+        # count, so an unchanged pair means an unchanged page. Only a
+        # conditional request can be answered with a 304, so only then does
+        # the version check run before the page is fetched.
+        if request.headers.get("if-none-match"):
+            latest_updated_at, total = await firestore_service.get_health_records_version(uid)
+            etag = make_etag(uid, latest_updated_at, total, limit, cursor, projection)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            records = await firestore_service.get_user_health_records(uid, **page_args)
+        else:
+            (latest_updated_at, total), records = await asyncio.gather(
+                firestore_service.get_health_records_version(uid),
+                firestore_service.get_user_health_records(uid, **page_args)
+            )
+            etag = make_etag(uid, latest_updated_at, total, limit, cursor, projection)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+
+        has_more = len(records) > limit
+        records = records[:limit]
+        next_cursor = encode_cursor(records[-1]) if has_more else None
 
         return {
             "success": True,
             "data": {
                 "records": records,
                 "count": len(records),
-                "next_cursor": None  # Implement cursor logic for pagination
+                "has_more": has_more,
+                "next_cursor": next_cursor
             }
         }
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error listing health records: {e}")
+        logger.error("Error listing health records: %s", e)
         raise HTTPException(status_code=500, detail="Failed to list health records")
 
 
+# Registered before /{record_id} so "stats" is not taken for a record ID
+@router.get("/stats", status_code=status.HTTP_200_OK)
+async def get_health_stats(
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service)
+):
+    """Summary statistics over the authenticated user's health records"""
+    try:
+        uid = current_user["uid"]
+        stats = await firestore_service.get_health_stats(uid)
+        return {"success": True, "data": stats}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error getting health stats: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to get health stats")
+
+
 @router.get("/{record_id}", status_code=status.HTTP_200_OK)
 async def get_health_record(
     record_id: str,
+    request: Request,
+    response: Response,
     current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
@@ -139,46 +206,52 @@ async def get_health_record(
         if rec.get("user_id") != uid:
             raise HTTPException(status_code=403, detail="Access denied")
 
+        # Unchanged since the client's copy: skip sending the body again
+        etag = make_etag(record_id, rec.get("updated_at"))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+
         return {"success": True, "data": rec}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error fetching health record {record_id}: {e}")
+        logger.error("Error fetching health record %s: %s", record_id, e)
         raise HTTPException(status_code=500, detail="Failed to fetch health record")
 
 
 @router.put("/{record_id}", status_code=status.HTTP_200_OK)
 async def update_health_record(
     record_id: str,
-    update_data: Dict[str, Any] = Body(...),
+    update: HealthRecordUpdate,
     current_user: Dict[str, Any] = Depends(get_current_user),
     firestore_service: FirestoreService = Depends(get_firestore_service)
 ):
     """Update allowed fields on a health record"""
     try:
         uid = current_user["uid"]
-        record = await firestore_service.get_health_record(record_id)
-        if not record:
-            raise HTTPException(status_code=404, detail="Record not found")
-
-        if record.get("user_id") != uid:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        # Remove protected fields
-        for p in ("id", "user_id", "created_at"):
-            update_data.pop(p, None)
 
+        # The model has no server-set fields, so nothing protected gets through
+        update_data = update.model_dump(exclude_unset=True)
         update_data["updated_at"] = now_iso()
 
-        updated = await firestore_service.update_health_record(record_id, update_data)
+        # Ownership check and write happen in one service call
+        updated = await firestore_service.update_health_record_if_owner(record_id, uid, update_data)
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Record not found")
 
         return {"success": True, "message": "Record updated", "data": updated}
 
     except HTTPException:
         raise
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Access denied")
+    except FailedPrecondition:
+        raise HTTPException(status_code=409, detail="Record was modified concurrently, please retry")
     except Exception as e:
-        logger.error(f"Error updating health record {record_id}: {e}")
+        logger.error("Error updating health record %s: %s", record_id, e)
         raise HTTPException(status_code=500, detail="Failed to update health record")
 
 
@@ -191,19 +264,18 @@ async def delete_health_record(
     """Delete a health record (soft delete by default)"""
     try:
         uid = current_user["uid"]
-        record = await firestore_service.get_health_record(record_id)
-        if not record:
+        deleted = await firestore_service.delete_health_record_if_owner(record_id, uid)
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Record not found")
 
-        if record.get("user_id") != uid:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        deleted = await firestore_service.delete_health_record(record_id)
-
         return {"success": True, "message": "Record deleted", "data": {"deleted": deleted}}
 
     except HTTPException:
         raise
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Access denied")
+    except FailedPrecondition:
+        raise HTTPException(status_code=409, detail="Record was modified concurrently, please retry")
     except Exception as e:
-        logger.error(f"Error deleting health record {record_id}: {e}")
+        logger.error("Error deleting health record %s: %s", record_id, e)
         raise HTTPException(status_code=500, detail="Failed to delete health record")
@@ -1,168 +1,723 @@
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
-from typing import Dict, List, Optional, Any
+from google.api_core.exceptions import AlreadyExists, NotFound
+from cachetools import TTLCache
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Any
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Firestore rejects batches with more than 500 writes
+BATCH_WRITE_LIMIT = 500
+
+# Profiles are read on nearly every auth request; keep them briefly in
+# process. Writes through this service refresh or drop the entry.
+PROFILE_CACHE_TTL_SECONDS = 30
+PROFILE_CACHE_SIZE = 10000
+
+# Users whose stats summary is known to exist, so writes skip the check
+STATS_SEEDED_TTL_SECONDS = 60 * 60
+
+# OCR/NLP results are kept per user and document content hash, so one
+# user's extraction is never served to another. A Firestore TTL policy on
+# expires_at removes old entries; deleting the record or the account
+# removes them sooner.
+OCR_CACHE_TTL = timedelta(days=30)
+
+
+def _now_iso() -> str:
+    """UTC timestamp in the same ISO form the routes store"""
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _biomarker_summary(biomarkers: Any) -> Dict[str, Any]:
+    """Per-status biomarker counts and whether every biomarker is normal.
+
+    Stored on the record as status_histogram and all_normal at write time,
+    so reads never rescan the biomarkers.
+    """
+    histogram: Dict[str, int] = {}
+    if isinstance(biomarkers, dict):
+        for biomarker in biomarkers.values():
+            status = (biomarker.get('status') if isinstance(biomarker, dict) else None) or 'unknown'
+            histogram[status] = histogram.get(status, 0) + 1
+    return {
+        'status_histogram': histogram,
+        'all_normal': histogram.keys() <= {'normal'}
+    }
+
+
+# Fields of a record that feed its user's stats summary
+STATS_FIELDS = ['user_id', 'type', 'all_normal', 'deleted']
+# Soft deletes also drop the upload's OCR cache entry
+SOFT_DELETE_FIELDS = STATS_FIELDS + ['document_sha256']
+
+
+def _stats_increments(record: Dict[str, Any], step: int) -> Dict[str, Any]:
+    """Summary counter changes for adding (step=1) or removing (step=-1) a record"""
+    return {
+        'total_records': firestore.Increment(step),
+        'normal_results': firestore.Increment(step if record.get('all_normal') else 0),
+        'type_counts': {record.get('type') or 'Unknown': firestore.Increment(step)}
+    }
+
+
+def _stats_update_increments(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Summary counter changes for an edit to a record, or None if there are none"""
+    old_type = old.get('type') or 'Unknown'
+    new_type = new.get('type') or 'Unknown'
+    normal_delta = int(bool(new.get('all_normal'))) - int(bool(old.get('all_normal')))
+    if old_type == new_type and not normal_delta:
+        return None
+    increments: Dict[str, Any] = {'normal_results': firestore.Increment(normal_delta)}
+    if old_type != new_type:
+        increments['type_counts'] = {
+            old_type: firestore.Increment(-1),
+            new_type: firestore.Increment(1)
+        }
+    return increments
+
 class FirestoreService:
     def __init__(self):
-        self.db = firestore.Client(project=settings.firebase_project_id)
+        # The async client issues RPCs on the event loop; create the service
+        # from a running loop (the app's startup hook)
+        self.db = firestore.AsyncClient(project=settings.firebase_project_id)
+        self._profile_cache: TTLCache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL_SECONDS)
+        self._stats_seeded: TTLCache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=STATS_SEEDED_TTL_SECONDS)
     
     async def test_connection(self) -> bool:
         """Test Firestore connection"""
         try:
             # Try to read from a test collection
-            self.db.collection('test').limit(1).get()
+            await self.db.collection('test').limit(1).get()
             return True
         except Exception as e:
-            logger.error(f"Firestore connection test failed: {str(e)}")
+            logger.error("Firestore connection test failed: %s", e)
             raise e
     
     # User Profile operations
     async def create_user_profile(self, user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a new user profile"""
+        """Create a new user profile; user_data is completed in place.
+
+        created_at and updated_at passed by the caller are kept, so they
+        match its other timestamp fields; missing ones are filled in.
+        """
         try:
-            user_dict = dict(user_data)
+            user_dict = user_data
             user_dict['id'] = user_id
-            user_dict['created_at'] = datetime.utcnow().isoformat()
-            user_dict['updated_at'] = datetime.utcnow().isoformat()
+            # Stored as native timestamps so reads come back as datetimes
+            if 'created_at' not in user_dict:
+                user_dict['created_at'] = datetime.now(timezone.utc)
+            user_dict.setdefault('updated_at', user_dict['created_at'])
             
-            self.db.collection('users').document(user_id).set(user_dict)
-            logger.info(f"User profile created: {user_id}")
+            await self.db.collection('users').document(user_id).set(user_dict)
+            self._profile_cache[user_id] = dict(user_dict)
+            logger.info("User profile created: %s", user_id)
             return user_dict
         except Exception as e:
-            logger.error(f"Error creating user profile: {str(e)}")
+            logger.error("Error creating user profile: %s", e)
             raise e
     
     async def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user profile by ID"""
+        """Get user profile by ID, served from a short-lived cache when possible"""
         try:
-            doc = self.db.collection('users').document(user_id).get()
+            cached = self._profile_cache.get(user_id)
+            if cached is not None:
+                return dict(cached)
+            
+            doc = await self.db.collection('users').document(user_id).get()
             if doc.exists:
-                return doc.to_dict()
+                profile = doc.to_dict()
+                self._profile_cache[user_id] = profile
+                return dict(profile)
             return None
         except Exception as e:
-            logger.error(f"Error getting user profile: {str(e)}")
+            logger.error("Error getting user profile: %s", e)
             raise e
     
     async def update_user_profile(self, user_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Update user profile"""
+        """Update user profile and return the fields that were written.
+
+        update_data is modified in place and returned. An updated_at the
+        caller passes is kept, so it can match the caller's other
+        timestamp fields.
+        """
         try:
-            update_dict = dict(update_data)
-            update_dict['updated_at'] = datetime.utcnow().isoformat()
+            update_dict = update_data
+            update_dict.setdefault('updated_at', datetime.now(timezone.utc))
             
-            self.db.collection('users').document(user_id).update(update_dict)
-            logger.info(f"User profile updated: {user_id}")
+            await self.db.collection('users').document(user_id).update(update_dict)
+            self._profile_cache.pop(user_id, None)
+            logger.info("User profile updated: %s", user_id)
+            return update_dict
+        except Exception as e:
+            logger.error("Error updating user profile: %s", e)
+            raise e
+    
+    async def update_user_profile_with_completion(
+        self,
+        user_id: str,
+        update_data: Dict[str, Any],
+        required_fields: tuple = ('name', 'phone')
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update a user profile, recomputing profile_completed from the
+        update merged over the current profile. Returns the updated
+        profile, or None if there is no profile to update. update_data is
+        modified in place.
+        """
+        try:
+            current_profile = await self.get_user_profile(user_id)
+            if current_profile is None:
+                return None
+            
+            update_dict = update_data
+            update_dict['profile_completed'] = all(
+                update_dict.get(field) or current_profile.get(field)
+                for field in required_fields
+            )
+            update_dict['updated_at'] = datetime.now(timezone.utc)
             
-            # Return updated profile
-            return await self.get_user_profile(user_id)
+            await self.db.collection('users').document(user_id).update(update_dict)
+            current_profile.update(update_dict)
+            self._profile_cache[user_id] = dict(current_profile)
+            logger.info("User profile updated: %s", user_id)
+            return current_profile
         except Exception as e:
-            logger.error(f"Error updating user profile: {str(e)}")
+            logger.error("Error updating user profile: %s", e)
+            raise e
+    
+    async def get_user_profile_fields(self, user_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        """Get only the given fields of a user profile"""
+        try:
+            doc = await self.db.collection('users').document(user_id).get(field_paths=fields)
+            if doc.exists:
+                return doc.to_dict()
+            return None
+        except Exception as e:
+            logger.error("Error getting user profile fields: %s", e)
+            raise e
+    
+    async def get_user_stats_bundle(
+        self,
+        user_id: str,
+        profile_fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Get a user's profile (optionally projected) and health record count in parallel"""
+        try:
+            profile_ref = self.db.collection('users').document(user_id)
+            count_query = self._live_records(user_id).count(alias='total')
+            
+            # A count aggregation is computed server-side; no records are sent back
+            cached = self._profile_cache.get(user_id)
+            if cached is not None:
+                count_result = await count_query.get()
+                profile = dict(cached)
+                if profile_fields:
+                    profile = {k: profile[k] for k in profile_fields if k in profile}
+            else:
+                profile_doc, count_result = await asyncio.gather(
+                    profile_ref.get(field_paths=profile_fields),
+                    count_query.get()
+                )
+                profile = profile_doc.to_dict() if profile_doc.exists else None
+            
+            return {
+                'profile': profile,
+                'record_count': int(count_result[0][0].value)
+            }
+        except Exception as e:
+            logger.error("Error getting user stats: %s", e)
             raise e
     
     # Health record operations
-    async def create_health_record(self, record_data: Dict[str, Any]) -> str:
-        """Create a new health record and return the record ID"""
+    def _live_records(self, user_id: str):
+        """Query over a user's health records that have not been soft deleted"""
+        return self.db.collection('health_records').where(
+            filter=FieldFilter('user_id', '==', user_id)
+        ).where(
+            filter=FieldFilter('deleted', '==', False)
+        )
+    
+    async def create_health_record(self, record_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Create a new health record and return it as stored, with its ID and
+        the derived fields, so callers need no read-back. record_data is
+        completed in place and returned.
+        """
         try:
-            record_dict = dict(record_data)
-            record_dict['created_at'] = datetime.utcnow().isoformat()
-            record_dict['updated_at'] = datetime.utcnow().isoformat()
+            record_dict = record_data
+            # Keep caller-supplied timestamps so callers can echo the payload back
+            if 'created_at' not in record_dict:
+                record_dict['created_at'] = _now_iso()
+            record_dict.setdefault('updated_at', record_dict['created_at'])
+            record_dict.update(_biomarker_summary(record_dict.get('biomarkers')))
+            # Always present so the deleted == False filter matches new records
+            record_dict['deleted'] = False
             
-            # Add document to collection and get the reference
-            _, doc_ref = self.db.collection('health_records').add(record_dict)
-            logger.info(f"Health record created: {doc_ref.id}")
-            return doc_ref.id
+            # The record and its user's stats summary are written atomically
+            await self._ensure_stats_summary(record_dict['user_id'])
+            doc_ref = self.db.collection('health_records').document()
+            batch = self.db.batch()
+            batch.set(doc_ref, record_dict)
+            batch.set(
+                self._stats_ref(record_dict['user_id']),
+                _stats_increments(record_dict, 1),
+                merge=True
+            )
+            await batch.commit()
+            logger.info("Health record created: %s", doc_ref.id)
+            record_dict['id'] = doc_ref.id
+            return record_dict
         except Exception as e:
-            logger.error(f"Error creating health record: {str(e)}")
+            logger.error("Error creating health record: %s", e)
             raise e
     
     async def get_user_health_records(
         self, 
         user_id: str, 
         limit: Optional[int] = None,
-        cursor: Optional[str] = None
+        cursor: Optional[Dict[str, str]] = None,
+        fields: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
-        """Get health records for a user with optional pagination"""
+        """
+        Get health records for a user, newest first. cursor holds the
+        created_at and id of the last record on the previous page; the
+        document ID breaks ties so the ordering is total and no record is
+        skipped or repeated between pages. fields, if given, limits the
+        fields returned for each record.
+        """
         try:
-            query = self.db.collection('health_records').where(
-                filter=FieldFilter('user_id', '==', user_id)
-            ).order_by('created_at', direction=firestore.Query.DESCENDING)
+            collection = self.db.collection('health_records')
+            query = self._live_records(user_id).order_by(
+                'created_at', direction=firestore.Query.DESCENDING
+            ).order_by(
+                '__name__', direction=firestore.Query.DESCENDING
+            )
+            
+            if fields:
+                query = query.select(fields)
             
             if limit:
                 query = query.limit(limit)
             
             if cursor:
-                # Get the cursor document for pagination
-                cursor_doc = self.db.collection('health_records').document(cursor).get()
-                if cursor_doc.exists:
-                    query = query.start_after(cursor_doc)
+                query = query.start_after({
+                    'created_at': cursor['created_at'],
+                    '__name__': collection.document(cursor['id'])
+                })
             
-            docs = query.stream()
             records = []
             
-            for doc in docs:
+            async for doc in query.stream():
                 record_dict = doc.to_dict()
                 record_dict['id'] = doc.id
                 records.append(record_dict)
             
-            logger.info(f"Retrieved {len(records)} health records for user {user_id}")
+            logger.info("Retrieved %s health records for user %s", len(records), user_id)
             return records
         except Exception as e:
-            logger.error(f"Error getting health records: {str(e)}")
+            logger.error("Error getting health records: %s", e)
+            raise e
+    
+    async def get_health_records_version(self, user_id: str) -> Tuple[Optional[str], int]:
+        """
+        The latest updated_at across a user's health records and how many
+        there are; changes whenever a record is created, edited or deleted.
+        Costs a one-document projection and a count aggregation.
+        """
+        try:
+            user_records = self.db.collection('health_records').where(
+                filter=FieldFilter('user_id', '==', user_id)
+            )
+            latest_query = user_records.order_by(
+                'updated_at', direction=firestore.Query.DESCENDING
+            ).select(['updated_at']).limit(1)
+            
+            latest, count = await asyncio.gather(
+                latest_query.get(),
+                user_records.count(alias='total').get()
+            )
+            latest_updated_at = latest[0].get('updated_at') if latest else None
+            return latest_updated_at, int(count[0][0].value)
+        except Exception as e:
+            logger.error("Error getting health records version: %s", e)
             raise e
     
-    async def get_health_record(self, record_id: str) -> Optional[Dict[str, Any]]:
-        """Get a specific health record"""
+    async def get_health_record(
+        self,
+        record_id: str,
+        fields: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Get a specific health record, limited to fields if given"""
         try:
-            doc = self.db.collection('health_records').document(record_id).get()
+            doc = await self.db.collection('health_records').document(record_id).get(field_paths=fields)
             if doc.exists:
                 record_dict = doc.to_dict()
                 record_dict['id'] = doc.id
                 return record_dict
             return None
         except Exception as e:
-            logger.error(f"Error getting health record: {str(e)}")
+            logger.error("Error getting health record: %s", e)
             raise e
     
     async def update_health_record(self, record_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Update a health record"""
+        """Update a health record and return the fields that were written.
+
+        update_data is modified in place and returned.
+        """
         try:
-            update_dict = dict(update_data)
-            update_dict['updated_at'] = datetime.utcnow().isoformat()
+            update_dict = update_data
+            update_dict['updated_at'] = _now_iso()
+            if 'biomarkers' in update_dict:
+                update_dict.update(_biomarker_summary(update_dict['biomarkers']))
             
-            self.db.collection('health_records').document(record_id).update(update_dict)
-            logger.info(f"Health record updated: {record_id}")
+            ref = self.db.collection('health_records').document(record_id)
+            snap = await ref.get(field_paths=STATS_FIELDS)
+            if not snap.exists:
+                raise NotFound(f"Health record {record_id} not found")
+            await self._commit_record_update(ref, snap, update_dict)
+            logger.info("Health record updated: %s", record_id)
+            return update_dict
+        except Exception as e:
+            logger.error("Error updating health record: %s", e)
+            raise e
+    
+    async def update_health_record_if_owner(
+        self,
+        record_id: str,
+        user_id: str,
+        update_data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update a health record only if it belongs to user_id and return the
+        merged record, or None if it does not exist. Raises PermissionError
+        for another user's record. The write is conditioned on the document
+        being unchanged since the ownership read. update_data is modified
+        in place.
+        """
+        try:
+            ref = self.db.collection('health_records').document(record_id)
+            snap = await ref.get()
+            if not snap.exists:
+                return None
+            record = snap.to_dict()
+            if record.get('user_id') != user_id:
+                raise PermissionError(record_id)
+            
+            update_dict = update_data
+            update_dict['updated_at'] = _now_iso()
+            if 'biomarkers' in update_dict:
+                update_dict.update(_biomarker_summary(update_dict['biomarkers']))
+            
+            await self._commit_record_update(ref, snap, update_dict)
+            logger.info("Health record updated: %s", record_id)
+            
+            record.update(update_dict)
+            record['id'] = record_id
+            return record
+        except PermissionError:
+            raise
+        except Exception as e:
+            logger.error("Error updating health record: %s", e)
+            raise e
+    
+    async def delete_health_record_if_owner(self, record_id: str, user_id: str) -> Optional[bool]:
+        """
+        Soft delete a health record only if it belongs to user_id. Returns
+        None if it does not exist and raises PermissionError for another
+        user's record.
+        """
+        try:
+            ref = self.db.collection('health_records').document(record_id)
+            snap = await ref.get(field_paths=SOFT_DELETE_FIELDS)
+            if not snap.exists:
+                return None
+            if snap.get('user_id') != user_id:
+                raise PermissionError(record_id)
             
-            # Return updated record
-            return await self.get_health_record(record_id)
+            await self._commit_record_soft_delete(ref, snap)
+            logger.info("Health record soft deleted: %s", record_id)
+            return True
+        except PermissionError:
+            raise
         except Exception as e:
-            logger.error(f"Error updating health record: {str(e)}")
+            logger.error("Error deleting health record: %s", e)
             raise e
     
     async def delete_health_record(self, record_id: str) -> bool:
         """Delete a health record (soft delete by default)"""
         try:
             # Soft delete - mark as deleted
-            self.db.collection('health_records').document(record_id).update({
-                'deleted': True,
-                'deleted_at': datetime.utcnow().isoformat()
-            })
-            logger.info(f"Health record soft deleted: {record_id}")
+            ref = self.db.collection('health_records').document(record_id)
+            snap = await ref.get(field_paths=SOFT_DELETE_FIELDS)
+            if not snap.exists:
+                raise NotFound(f"Health record {record_id} not found")
+            await self._commit_record_soft_delete(ref, snap)
+            logger.info("Health record soft deleted: %s", record_id)
             return True
         except Exception as e:
-            logger.error(f"Error deleting health record: {str(e)}")
+            logger.error("Error deleting health record: %s", e)
+            raise e
+    
+    def _stats_ref(self, user_id: str):
+        """Per-user summary of health record counts, kept in step with record writes"""
+        return self.db.collection('users').document(user_id).collection('stats').document('summary')
+    
+    async def _ensure_stats_summary(self, user_id: str) -> None:
+        """
+        Seed a user's stats summary from their records if it does not exist.
+
+        Records written before the summary existed are otherwise never
+        counted: the first increment would create it from zero. Call this
+        before writing a record. The seed is created with create(), which
+        fails if a concurrent writer seeded it first, so a record is never
+        counted both in a seed and by an increment.
+        """
+        if user_id in self._stats_seeded:
+            return
+        ref = self._stats_ref(user_id)
+        summary = await ref.get(field_paths=['total_records'])
+        if not summary.exists:
+            stats = await self._aggregate_health_stats(user_id)
+            try:
+                await ref.create({
+                    'total_records': stats['total_records'],
+                    'normal_results': stats['normal_records'],
+                    'type_counts': stats['type_distribution']
+                })
+                logger.info("Stats summary seeded for user %s", user_id)
+            except AlreadyExists:
+                pass
+        self._stats_seeded[user_id] = True
+    
+    async def _commit_record_update(self, ref, snap, update_dict: Dict[str, Any]) -> None:
+        """
+        Apply an update read as snap, adjusting the stats summary in the same
+        batch. The write fails with FailedPrecondition if the record changed
+        after the read.
+        """
+        option = self.db.write_option(last_update_time=snap.update_time)
+        batch = self.db.batch()
+        batch.update(ref, update_dict, option=option)
+        
+        old = snap.to_dict() or {}
+        if not old.get('deleted'):
+            increments = _stats_update_increments(old, {**old, **update_dict})
+            if increments:
+                await self._ensure_stats_summary(old['user_id'])
+                batch.set(self._stats_ref(old['user_id']), increments, merge=True)
+        await batch.commit()
+    
+    async def _commit_record_soft_delete(self, ref, snap) -> None:
+        """
+        Mark the record read as snap deleted, take it out of the stats
+        summary and drop the cached extraction of its upload, if any
+        """
+        record = snap.to_dict() or {}
+        if record.get('deleted'):
+            return
+        await self._ensure_stats_summary(record['user_id'])
+        option = self.db.write_option(last_update_time=snap.update_time)
+        batch = self.db.batch()
+        deleted_at = _now_iso()
+        batch.update(ref, {
+            'deleted': True,
+            'deleted_at': deleted_at,
+            'updated_at': deleted_at
+        }, option=option)
+        batch.set(self._stats_ref(record['user_id']), _stats_increments(record, -1), merge=True)
+        if record.get('document_sha256'):
+            batch.delete(self._ocr_cache_ref(record['user_id'], record['document_sha256']))
+        await batch.commit()
+    
+    async def get_health_stats(self, user_id: str) -> Dict[str, Any]:
+        """
+        Dashboard statistics for a user's health records. Counts come from
+        the stats summary document; the most recent date is a one-document
+        query. Users without a summary fall back to aggregation queries.
+        """
+        try:
+            recent_query = self._live_records(user_id).order_by(
+                'date', direction=firestore.Query.DESCENDING
+            ).select(['date']).limit(1)
+            
+            summary, recent = await asyncio.gather(
+                self._stats_ref(user_id).get(),
+                recent_query.get()
+            )
+            recent_date = recent[0].get('date') if recent else None
+            
+            if not summary.exists:
+                stats = await self._aggregate_health_stats(user_id)
+                stats['recent_date'] = recent_date
+                return stats
+            
+            summary_dict = summary.to_dict()
+            return {
+                'total_records': summary_dict.get('total_records', 0),
+                'normal_records': summary_dict.get('normal_results', 0),
+                'recent_date': recent_date,
+                # Types whose records were all removed keep a zero counter
+                'type_distribution': {
+                    record_type: count
+                    for record_type, count in summary_dict.get('type_counts', {}).items()
+                    if count > 0
+                }
+            }
+        except Exception as e:
+            logger.error("Error getting health stats: %s", e)
+            raise e
+    
+    async def _aggregate_health_stats(self, user_id: str) -> Dict[str, Any]:
+        """Compute record counts with aggregation queries and a type projection"""
+        user_records = self._live_records(user_id)
+        total_query = user_records.count(alias='total')
+        normal_query = user_records.where(
+            filter=FieldFilter('all_normal', '==', True)
+        ).count(alias='total')
+        types_query = user_records.select(['type'])
+        
+        total, normal, types = await asyncio.gather(
+            total_query.get(),
+            normal_query.get(),
+            types_query.get()
+        )
+        
+        type_distribution: Dict[str, int] = {}
+        for doc in types:
+            record_type = doc.to_dict().get('type') or 'Unknown'
+            type_distribution[record_type] = type_distribution.get(record_type, 0) + 1
+        
+        return {
+            'total_records': int(total[0][0].value),
+            'normal_records': int(normal[0][0].value),
+            'type_distribution': type_distribution
+        }
+    
+    async def delete_health_stats(self, user_id: str) -> None:
+        """Drop a user's stats summary, e.g. once all their records are deleted"""
+        try:
+            await self._stats_ref(user_id).delete()
+            self._stats_seeded.pop(user_id, None)
+        except Exception as e:
+            logger.error("Error deleting health stats: %s", e)
+            raise e
+    
+    # Document extraction cache
+    def _ocr_cache_ref(self, user_id: str, digest: str):
+        """Cache entry for one user's document; users never share entries"""
+        return self.db.collection('ocr_cache').document(f"{user_id}_{digest}")
+    
+    async def get_ocr_cache(self, user_id: str, digest: str) -> Optional[Dict[str, Any]]:
+        """Cached extraction of a user's document with this SHA-256 digest, if any"""
+        try:
+            doc = await self._ocr_cache_ref(user_id, digest).get()
+            if not doc.exists:
+                return None
+            entry = doc.to_dict()
+            # TTL deletion can lag expiry by up to a day
+            expires_at = entry.get('expires_at')
+            if expires_at and expires_at <= datetime.now(timezone.utc):
+                return None
+            return entry
+        except Exception as e:
+            logger.error("Error getting OCR cache entry: %s", e)
+            raise e
+    
+    async def set_ocr_cache(self, user_id: str, digest: str, entry: Dict[str, Any]) -> None:
+        """Store an extraction of a user's document; best effort, never raises"""
+        try:
+            now = datetime.now(timezone.utc)
+            await self._ocr_cache_ref(user_id, digest).set({
+                **entry,
+                'user_id': user_id,
+                'created_at': now,
+                'expires_at': now + OCR_CACHE_TTL
+            })
+        except Exception as e:
+            logger.warning("Could not store OCR cache entry: %s", e)
+    
+    async def delete_user_ocr_cache(self, user_id: str) -> int:
+        """Delete every cached extraction of a user's documents; returns the count"""
+        try:
+            query = self.db.collection('ocr_cache').where(
+                filter=FieldFilter('user_id', '==', user_id)
+            ).select([]).limit(BATCH_WRITE_LIMIT)
+            deleted = 0
+            while True:
+                docs = await query.get()
+                if not docs:
+                    break
+                batch = self.db.batch()
+                for doc in docs:
+                    batch.delete(doc.reference)
+                await batch.commit()
+                deleted += len(docs)
+                if len(docs) < BATCH_WRITE_LIMIT:
+                    break
+            logger.info("OCR cache entries deleted for user %s: %s", user_id, deleted)
+            return deleted
+        except Exception as e:
+            logger.error("Error deleting OCR cache entries: %s", e)
+            raise e
+    
+    async def stream_user_record_ids(
+        self,
+        user_id: str,
+        page_size: int = BATCH_WRITE_LIMIT
+    ) -> AsyncIterator[List[str]]:
+        """Yield a user's health record IDs a page at a time, without record data"""
+        # An empty projection returns only document references
+        query = self.db.collection('health_records').where(
+            filter=FieldFilter('user_id', '==', user_id)
+        ).select([]).limit(page_size)
+        
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = await page_query.get()
+            if not docs:
+                return
+            yield [doc.id for doc in docs]
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+    
+    async def bulk_soft_delete_health_records(self, record_ids: List[str]) -> int:
+        """Soft delete many health records with batched writes; returns the count"""
+        try:
+            deleted_at = _now_iso()
+            collection = self.db.collection('health_records')
+            batches = []
+            for start in range(0, len(record_ids), BATCH_WRITE_LIMIT):
+                batch = self.db.batch()
+                for record_id in record_ids[start:start + BATCH_WRITE_LIMIT]:
+                    batch.update(collection.document(record_id), {
+                        'deleted': True,
+                        'deleted_at': deleted_at,
+                        'updated_at': deleted_at
+                    })
+                batches.append(batch)
+            
+            # Each commit is one RPC; run them side by side
+            await asyncio.gather(*(batch.commit() for batch in batches))
+            logger.info("Health records soft deleted: %s in %s batches", len(record_ids), len(batches))
+            return len(record_ids)
+        except Exception as e:
+            logger.error("Error bulk deleting health records: %s", e)
             raise e
     
     async def hard_delete_health_record(self, record_id: str) -> bool:
         """Permanently delete a health record"""
         try:
-            self.db.collection('health_records').document(record_id).delete()
-            logger.info(f"Health record hard deleted: {record_id}")
+            await self.db.collection('health_records').document(record_id).delete()
+            logger.info("Health record hard deleted: %s", record_id)
             return True
         except Exception as e:
-            logger.error(f"Error hard deleting health record: {str(e)}")
+            logger.error("Error hard deleting health record: %s", e)
             raise e
@@ -1,20 +1,225 @@
 import re
+import asyncio
+import calendar
+import copy
+import hashlib
 import spacy
-import nltk
+from cachetools import LRUCache
 from typing import Dict, List, Any, Optional, Tuple
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 
-logger = logging.getLogger(__name__)
+# google-re2 (pip install google-re2) matches in linear time with no
+# backtracking; the combined biomarker regex uses it when installed
+try:
+    import re2
+except ImportError:
+    re2 = None
 
-# Download required NLTK data (run once)
+# pyahocorasick (pip install pyahocorasick) finds all confidence and test
+# type keywords in one pass over the text; plain substring checks are used
+# without it
 try:
-    nltk.download('punkt', quiet=True)
-    nltk.download('stopwords', quiet=True)
-    nltk.download('averaged_perceptron_tagger', quiet=True)
-except:
-    logger.warning("Could not download NLTK data")
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# Extraction is deterministic on the text, and the same lab report is often
+# uploaded more than once, so recent results are kept by text hash. Fields
+# that depend on when the request is made are filled in on every return.
+EXTRACTION_CACHE_SIZE = 4096
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Only doc.ents is read, so the components NER does not need are not loaded
+SPACY_EXCLUDED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+# Documents waiting for NER are run through nlp.pipe together, off the event
+# loop, in batches of up to this many
+NER_BATCH_SIZE = 16
+ENTITY_LABELS = frozenset({'ORG', 'PERSON', 'DATE', 'CARDINAL', 'QUANTITY'})
+
+# Keywords whose presence raises the extraction confidence
+MEDICAL_KEYWORDS = (
+    'test', 'result', 'normal', 'abnormal', 'range',
+    'laboratory', 'clinic', 'hospital', 'doctor', 'patient'
+)
+
+
+def _build_keyword_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in MEDICAL_KEYWORDS:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+
+KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+# Biomarker names used to infer the test type when no test name is found,
+# in priority order
+TEST_TYPE_FALLBACK_TERMS = {
+    'Lipid Panel': ('cholesterol', 'ldl', 'hdl', 'triglycerides'),
+    'Liver Function Test': ('alt', 'ast', 'bilirubin', 'albumin'),
+    'Complete Blood Count': ('hemoglobin', 'wbc', 'platelets', 'hematocrit'),
+}
+TEST_TYPE_FALLBACK_ORDER = list(TEST_TYPE_FALLBACK_TERMS)
+
+
+def _build_test_type_fallback_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for priority, terms in enumerate(TEST_TYPE_FALLBACK_TERMS.values()):
+        for term in terms:
+            # Keep the highest priority if a term is shared between types
+            existing = automaton.get(term, priority)
+            automaton.add_word(term, min(existing, priority))
+    automaton.make_automaton()
+    return automaton
+
+
+TEST_TYPE_FALLBACK_AUTOMATON = _build_test_type_fallback_automaton()
+
+# Numeric dates are split by this regex and their day/month order decided
+# from the numbers; only dates with month names go through strptime
+NUMERIC_DATE_RE = re.compile(r'^(\d{1,4})([-/])(\d{1,2})\2(\d{1,4})$')
+TEXT_DATE_FORMATS = ('%d %b %Y', '%d %B %Y', '%d %b %y', '%d %B %y')
+
+# Unit spellings normalized before matching, in one pass
+UNIT_SPELLINGS = {'mg%': 'mg/dl', 'gm%': 'g/dl', 'gm/dl': 'g/dl'}
+UNIT_SPELLING_RE = re.compile('|'.join(re.escape(u) for u in UNIT_SPELLINGS))
+
+# OCR often reads digits as look-alike letters. Rather than rewriting those
+# letters everywhere in the text, biomarker value captures also accept them
+# and the captured value is translated back before parsing.
+DECIMAL_GROUP = r'(\d+\.?\d*)'
+OCR_DECIMAL_GROUP = r'([\doil|]+(?:\.[\doil|]*)?)'
+OCR_DIGITS = str.maketrans('oil|', '0111')
+
+
+def _utc_now_iso() -> str:
+    """UTC timestamp in the same ISO form the routes store"""
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _parse_ocr_number(raw: str) -> float:
+    """Parse a captured value, mapping OCR look-alikes back to digits"""
+    if not any(c.isdigit() for c in raw):
+        raise ValueError(f"No digits in {raw!r}")
+    return float(raw.lower().translate(OCR_DIGITS))
+
+
+def _compile_caseless(pattern: str, multiline: bool = False):
+    """Compile a case-insensitive pattern with RE2 if available, else re"""
+    if re2 is not None:
+        try:
+            return re2.compile(('(?im)' if multiline else '(?i)') + pattern)
+        except re2.error as e:
+            logger.warning("RE2 cannot compile pattern, using re: %s", e)
+    return re.compile(pattern, re.IGNORECASE | (re.MULTILINE if multiline else 0))
+
+
+def _union_pattern(named_patterns: List[Tuple[str, str]], multiline: bool = False) -> Tuple[Any, Dict[str, Tuple[int, int]]]:
+    """
+    Join (group name, pattern) alternatives into one case-insensitive regex
+    so the text is scanned once. Each alternative is wrapped in its named
+    group; the returned map gives that group's index and how many groups the
+    alternative has, which follow it from index + 1. multiline makes ^ and $
+    match at line boundaries.
+    """
+    alternatives = []
+    groups = {}
+    index = 1
+    for group_name, pattern in named_patterns:
+        inner_groups = re.compile(pattern).groups
+        alternatives.append(f"(?P<{group_name}>{pattern})")
+        groups[group_name] = (index, inner_groups)
+        index += 1 + inner_groups
+    return _compile_caseless('|'.join(alternatives), multiline), groups
+
+
+# Indexed by how many bands a value falls in: the borderline band contains
+# the normal band, so a normal value lands in both
+STATUS_BY_BANDS = ('abnormal', 'borderline', 'normal')
+
+
+def _make_value_reader(base: int, inner_groups: int, config: Dict[str, Any]):
+    """
+    Specialize the match -> biomarker conversion for one pattern whose
+    groups follow index base. Unit, range and band limits are bound once
+    here instead of being looked up for every match.
+    """
+    value_index = base + 1
+    unit_index = base + 2 if inner_groups > 1 else None
+    default_unit = config['unit']
+    value_range = config['normal_range']
+    low = config.get('normal_min', 0)
+    high = config.get('normal_max', float('inf'))
+    border_low, border_high = low * 0.9, high * 1.1
+
+    def read(match) -> Dict[str, Any]:
+        value = _parse_ocr_number(match.group(value_index))
+        return {
+            'value': value,
+            'unit': match.group(unit_index) if unit_index else default_unit,
+            'range': value_range,
+            'status': STATUS_BY_BANDS[(border_low <= value <= border_high) + (low <= value <= high)]
+        }
+
+    return read
+
+
+def _make_bp_reader(base: int, config: Dict[str, Any]):
+    """Like _make_value_reader, for a systolic/diastolic blood pressure pattern"""
+    unit = config['unit']
+    value_range = config['normal_range']
+    systolic_max = config['normal_systolic_max']
+    diastolic_max = config['normal_diastolic_max']
+    systolic_border, diastolic_border = systolic_max * 1.1, diastolic_max * 1.1
+
+    def read(match) -> Dict[str, Any]:
+        systolic = float(match.group(base + 1))
+        diastolic = float(match.group(base + 2))
+        if systolic <= systolic_max and diastolic <= diastolic_max:
+            status = 'normal'
+        elif systolic <= systolic_border and diastolic <= diastolic_border:
+            status = 'borderline'
+        else:
+            status = 'abnormal'
+        return {
+            'systolic': systolic,
+            'diastolic': diastolic,
+            'unit': unit,
+            'range': value_range,
+            'status': status
+        }
+
+    return read
+
+
+def _first_by_priority(regex, groups: Dict[str, Tuple], text: str, accept=None):
+    """
+    The match of the highest-priority alternative in one scan of text, or
+    None. groups maps each alternative's group name to a tuple starting
+    with its priority, 0 being highest; a priority 0 match ends the scan.
+    Matches that accept, if given, returns false for are skipped.
+    """
+    best = None
+    best_priority = None
+    for match in regex.finditer(text):
+        priority = groups[match.lastgroup][0]
+        if (best is None or priority < best_priority) and (accept is None or accept(match)):
+            best, best_priority = match, priority
+            if priority == 0:
+                break
+    return best
+
 
 class NLPService:
     """Natural Language Processing service for medical document analysis"""
@@ -23,7 +228,7 @@ class NLPService:
         """Initialize NLP service with spaCy model"""
         try:
             # Load English model
-            self.nlp = spacy.load("en_core_web_sm")
+            self.nlp = spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDED_PIPES)
             logger.info("spaCy model loaded successfully")
         except OSError:
             logger.error("spaCy English model not found. Install with: python -m spacy download en_core_web_sm")
@@ -31,13 +236,20 @@ class NLPService:
         
         # Medical terminology patterns
         self.biomarker_patterns = self._load_biomarker_patterns()
-        self.facility_patterns = self._load_facility_patterns()
-        self.date_patterns = self._load_date_patterns()
-        self.test_type_patterns = self._load_test_type_patterns()
+        self.facility_regex, self.facility_groups = self._load_facility_patterns()
+        self.date_regex, self.date_groups = self._load_date_patterns()
+        self.test_type_regex, self.test_type_groups = self._load_test_type_patterns()
+        self.biomarker_regex, self.biomarker_groups = self._build_biomarker_regex()
+        
+        self._extraction_cache: LRUCache = LRUCache(maxsize=EXTRACTION_CACHE_SIZE)
+        
+        # Started on first use, inside the running event loop
+        self._ner_queue: Optional[asyncio.Queue] = None
+        self._ner_worker: Optional[asyncio.Task] = None
     
     def _load_biomarker_patterns(self) -> Dict[str, Dict]:
         """Load biomarker patterns and normal ranges"""
-        return {
+        patterns = {
             # Blood Test Markers
             'hemoglobin': {
                 'patterns': [
@@ -195,19 +407,59 @@ class NLPService:
                 'normal_diastolic_max': 80
             }
         }
+        return patterns
     
-    def _load_facility_patterns(self) -> List[str]:
-        """Load patterns to identify medical facilities"""
-        return [
-            r'(.*?(?:hospital|clinic|medical center|diagnostics|lab|laboratory|healthcare|pathology).*?)(?:\n|$)',
-            r'(.*?(?:dr\.|doctor|physician).*?)(?:\n|$)',
-            r'report\s*from\s*:?\s*(.*?)(?:\n|$)',
-            r'issued\s*by\s*:?\s*(.*?)(?:\n|$)'
+    def _build_biomarker_regex(self) -> Tuple[Any, Dict[str, Tuple[str, Any]]]:
+        """
+        One regex over every biomarker's patterns, so the text is scanned
+        once for all of them. The returned map takes the name of the group
+        that matched to (biomarker, reader turning the match into its entry).
+        """
+        named_patterns = []
+        owners = {}
+        for biomarker_name, config in self.biomarker_patterns.items():
+            for i, pattern in enumerate(config['patterns']):
+                group_name = f"{biomarker_name}_{i}"
+                # Names must start a word, so 'alt' is not read out of 'salt'
+                pattern = r'\b' + pattern.replace(DECIMAL_GROUP, OCR_DECIMAL_GROUP)
+                named_patterns.append((group_name, pattern))
+                owners[group_name] = biomarker_name
+        regex, groups = _union_pattern(named_patterns)
+        
+        readers = {}
+        for group_name, (base, inner_groups) in groups.items():
+            biomarker_name = owners[group_name]
+            config = self.biomarker_patterns[biomarker_name]
+            if biomarker_name == 'blood_pressure':
+                read = _make_bp_reader(base, config)
+            else:
+                read = _make_value_reader(base, inner_groups, config)
+            readers[group_name] = (biomarker_name, read)
+        return regex, readers
+    
+    def _load_facility_patterns(self) -> Tuple[Any, Dict[str, Tuple[int, int]]]:
+        """
+        Load one regex to identify medical facilities, in priority order. The
+        map takes a group name to (priority, index of the group with the
+        facility). Keyword lines are anchored at a line start and never match
+        across a newline, so a line without a keyword is given up after one
+        pass over it.
+        """
+        patterns = [
+            r'^([^\n]*?\b(?:hospital|clinic|medical center|diagnostics|lab|laboratory|healthcare|pathology)\b[^\n]*)',
+            r'^([^\n]*?(?:\bdr\.|\bdoctor\b|\bphysician\b)[^\n]*)',
+            r'report\s*from\s*:?\s*([^\n]*)',
+            r'issued\s*by\s*:?\s*([^\n]*)'
         ]
+        regex, groups = _union_pattern([(f"facility{i}", p) for i, p in enumerate(patterns)], multiline=True)
+        return regex, {name: (priority, groups[name][0] + 1) for priority, name in enumerate(groups)}
     
-    def _load_date_patterns(self) -> List[str]:
-        """Load patterns to identify test dates"""
-        return [
+    def _load_date_patterns(self) -> Tuple[Any, Dict[str, Tuple[int, int]]]:
+        """
+        Load one regex to identify test dates, in priority order. The map
+        takes a group name to (priority, index of the group with the date).
+        """
+        patterns = [
             r'date\s*:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
             r'test\s*date\s*:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
             r'collected\s*on\s*:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
@@ -215,10 +467,15 @@ class NLPService:
             r'(\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{2,4})',
             r'(\d{1,2}\s+(?:january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{2,4})'
         ]
+        regex, groups = _union_pattern([(f"date{i}", p) for i, p in enumerate(patterns)])
+        return regex, {name: (priority, groups[name][0] + 1) for priority, name in enumerate(groups)}
     
-    def _load_test_type_patterns(self) -> Dict[str, List[str]]:
-        """Load patterns to identify test types"""
-        return {
+    def _load_test_type_patterns(self) -> Tuple[Any, Dict[str, Tuple[int, str]]]:
+        """
+        Load one regex to identify test types, in priority order. The map
+        takes a group name to (priority, test type).
+        """
+        patterns = {
             'Blood Test': [
                 r'complete\s*blood\s*count',
                 r'cbc',
@@ -254,6 +511,15 @@ class NLPService:
                 r't4'
             ]
         }
+        named_patterns = []
+        groups = {}
+        for priority, (test_type, type_patterns) in enumerate(patterns.items()):
+            for i, pattern in enumerate(type_patterns):
+                group_name = f"type{priority}_{i}"
+                named_patterns.append((group_name, pattern))
+                groups[group_name] = (priority, test_type)
+        regex, _ = _union_pattern(named_patterns)
+        return regex, groups
     
     async def extract_biomarkers(self, text: str) -> Dict[str, Any]:
         """Extract biomarkers and medical information from text"""
@@ -261,220 +527,218 @@ class NLPService:
             if not text:
                 return self._empty_result()
             
-            # Clean and preprocess text
-            cleaned_text = self._clean_text(text)
+            key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+            cached = self._extraction_cache.get(key)
+            if cached is not None:
+                return self._stamp_result(cached)
             
-            # Extract different components
-            biomarkers = self._extract_biomarker_values(cleaned_text)
-            test_type = self._extract_test_type(cleaned_text)
-            facility = self._extract_facility(cleaned_text)
-            test_date = self._extract_date(cleaned_text)
-            entities = self._extract_named_entities(cleaned_text) if self.nlp else []
+            # The regex passes are CPU work, so they run in a worker thread;
+            # NER is then batched with other documents in its own thread
+            cleaned_text, result = await asyncio.to_thread(self._extract_fields, text)
+            result['entities'] = await self._extract_named_entities(cleaned_text) if self.nlp else []
             
-            logger.info(f"Extracted {len(biomarkers)} biomarkers from text")
+            logger.info("Extracted %d biomarkers from text", len(result['biomarkers']))
             
-            return {
-                'biomarkers': biomarkers,
-                'test_type': test_type,
-                'facility': facility,
-                'date': test_date,
-                'entities': entities,
-                'confidence_score': self._calculate_confidence(biomarkers, text),
-                'text_length': len(text),
-                'processed_at': datetime.utcnow().isoformat()
-            }
+            # Failures return the empty result below and are not cached
+            self._extraction_cache[key] = result
+            return self._stamp_result(result)
             
         except Exception as e:
-            logger.error(f"Error extracting biomarkers: {e}")
+            logger.error("Error extracting biomarkers: %s", e)
             return self._empty_result()
     
+    def _stamp_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        A copy of a cacheable result with its time-dependent fields set for
+        this request. Callers get their own copy, so edits to it never reach
+        the cache.
+        """
+        stamped = copy.deepcopy(result)
+        if stamped['date'] is None:
+            # Default to current date if no date found
+            stamped['date'] = datetime.now().strftime('%Y-%m-%d')
+        stamped['processed_at'] = _utc_now_iso()
+        return stamped
+    
+    def _extract_fields(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Synchronous regex extraction; returns the cleaned text and the result
+        without entities. The result depends on the text alone: date is None
+        when no date is found and processed_at is left out, both for
+        _stamp_result to fill in.
+        """
+        # Clean and preprocess text
+        cleaned_text = self._clean_text(text)
+        
+        # Extract different components
+        biomarkers = self._extract_biomarker_values(cleaned_text)
+        return cleaned_text, {
+            'biomarkers': biomarkers,
+            'test_type': self._extract_test_type(cleaned_text),
+            'facility': self._extract_facility(cleaned_text),
+            'date': self._extract_date(cleaned_text),
+            'entities': [],
+            'confidence_score': self._calculate_confidence(biomarkers, cleaned_text),
+            'text_length': len(text)
+        }
+    
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text for better processing"""
         # Convert to lowercase for pattern matching
         text = text.lower()
         
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE_RE.sub(' ', text)
         
-        # Replace common OCR errors
-        replacements = {
-            'o': '0',  # Common OCR confusion
-            'i': '1',  # In numeric contexts
-            'l': '1',  # In numeric contexts
-            'mg%': 'mg/dl',
-            'gm%': 'g/dl',
-            'gm/dl': 'g/dl'
-        }
-        
-        for old, new in replacements.items():
-            text = text.replace(old, new)
-        
-        return text
+        # Normalize unit spellings; OCR digit confusions are handled by the
+        # biomarker value patterns, so words are left intact
+        return UNIT_SPELLING_RE.sub(lambda m: UNIT_SPELLINGS[m.group()], text)
     
     def _extract_biomarker_values(self, text: str) -> Dict[str, Dict[str, Any]]:
         """Extract biomarker values using regex patterns"""
         biomarkers = {}
         
-        for biomarker_name, config in self.biomarker_patterns.items():
-            for pattern in config['patterns']:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
-                
-                for match in matches:
-                    try:
-                        if biomarker_name == 'blood_pressure':
-                            # Special handling for blood pressure
-                            systolic = float(match.group(1))
-                            diastolic = float(match.group(2))
-                            
-                            status = self._determine_bp_status(
-                                systolic, diastolic, 
-                                config['normal_systolic_max'],
-                                config['normal_diastolic_max']
-                            )
-                            
-                            biomarkers[biomarker_name] = {
-                                'systolic': systolic,
-                                'diastolic': diastolic,
-                                'unit': config['unit'],
-                                'range': config['normal_range'],
-                                'status': status
-                            }
-                        else:
-                            # Standard biomarker handling
-                            value = float(match.group(1))
-                            unit = match.group(2) if len(match.groups()) > 1 else config['unit']
-                            
-                            status = self._determine_status(
-                                value, 
-                                config.get('normal_min', 0),
-                                config.get('normal_max', float('inf'))
-                            )
-                            
-                            biomarkers[biomarker_name] = {
-                                'value': value,
-                                'unit': unit,
-                                'range': config['normal_range'],
-                                'status': status
-                            }
-                        
-                        break  # Use first match found
-                    except (ValueError, IndexError) as e:
-                        logger.warning(f"Error parsing {biomarker_name}: {e}")
-                        continue
+        # The earliest match in the text wins for each biomarker
+        for match in self.biomarker_regex.finditer(text):
+            biomarker_name, read = self.biomarker_groups[match.lastgroup]
+            if biomarker_name in biomarkers:
+                continue
+            try:
+                biomarkers[biomarker_name] = read(match)
+            except (ValueError, IndexError) as e:
+                logger.warning("Error parsing %s: %s", biomarker_name, e)
+                continue
         
         return biomarkers
     
-    def _determine_status(self, value: float, min_normal: float, max_normal: float) -> str:
-        """Determine if a biomarker value is normal, borderline, or abnormal"""
-        if min_normal <= value <= max_normal:
-            return 'normal'
-        elif (min_normal * 0.9) <= value <= (max_normal * 1.1):
-            return 'borderline'
-        else:
-            return 'abnormal'
-    
-    def _determine_bp_status(self, systolic: float, diastolic: float, 
-                            normal_systolic: float, normal_diastolic: float) -> str:
-        """Determine blood pressure status"""
-        if systolic <= normal_systolic and diastolic <= normal_diastolic:
-            return 'normal'
-        elif systolic <= normal_systolic * 1.1 and diastolic <= normal_diastolic * 1.1:
-            return 'borderline'
-        else:
-            return 'abnormal'
-    
     def _extract_test_type(self, text: str) -> str:
         """Extract test type from text"""
-        for test_type, patterns in self.test_type_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text, re.IGNORECASE):
-                    return test_type
+        match = _first_by_priority(self.test_type_regex, self.test_type_groups, text)
+        if match:
+            return self.test_type_groups[match.lastgroup][1]
         
-        # Default inference based on biomarkers found
-        text_lower = text.lower()
-        if any(term in text_lower for term in ['cholesterol', 'ldl', 'hdl', 'triglycerides']):
-            return 'Lipid Panel'
-        elif any(term in text_lower for term in ['alt', 'ast', 'bilirubin', 'albumin']):
-            return 'Liver Function Test'
-        elif any(term in text_lower for term in ['hemoglobin', 'wbc', 'platelets', 'hematocrit']):
-            return 'Complete Blood Count'
-        else:
-            return 'Medical Test'
+        # Default inference based on biomarkers found; text is already lower-cased
+        if TEST_TYPE_FALLBACK_AUTOMATON is not None:
+            best = None
+            for _, priority in TEST_TYPE_FALLBACK_AUTOMATON.iter(text):
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+            return TEST_TYPE_FALLBACK_ORDER[best] if best is not None else 'Medical Test'
+        
+        for test_type, terms in TEST_TYPE_FALLBACK_TERMS.items():
+            if any(term in text for term in terms):
+                return test_type
+        return 'Medical Test'
     
     def _extract_facility(self, text: str) -> str:
         """Extract medical facility name from text"""
-        for pattern in self.facility_patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-            if match:
-                facility = match.group(1).strip()
-                if len(facility) > 5 and len(facility) < 100:  # Reasonable length
-                    return facility
+        def reasonable_length(match) -> bool:
+            facility = match.group(self.facility_groups[match.lastgroup][1]).strip()
+            return 5 < len(facility) < 100
+        
+        match = _first_by_priority(self.facility_regex, self.facility_groups, text, accept=reasonable_length)
+        if match:
+            return match.group(self.facility_groups[match.lastgroup][1]).strip()
         
         return 'Medical Facility'
     
-    def _extract_date(self, text: str) -> str:
-        """Extract test date from text"""
-        for pattern in self.date_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                date_str = match.group(1)
-                try:
-                    # Try to parse and standardize the date
-                    parsed_date = self._parse_date(date_str)
-                    return parsed_date
-                except:
-                    continue
+    def _extract_date(self, text: str) -> Optional[str]:
+        """Extract test date from text, or None if there is none"""
+        match = _first_by_priority(self.date_regex, self.date_groups, text)
+        if match:
+            # Parse and standardize the date
+            return self._parse_date(match.group(self.date_groups[match.lastgroup][1]))
         
-        # Default to current date if no date found
-        return datetime.now().strftime('%Y-%m-%d')
+        return None
     
-    def _parse_date(self, date_str: str) -> str:
-        """Parse various date formats and return standardized format"""
+    def _parse_date(self, date_str: str) -> Optional[str]:
+        """Parse various date formats and return standardized format, or None"""
         date_str = date_str.strip()
         
-        # Common date formats
-        formats = [
-            '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%m-%d-%Y',
-            '%d/%m/%y', '%d-%m-%y', '%m/%d/%y', '%m-%d-%y',
-            '%Y/%m/%d', '%Y-%m-%d'
-        ]
-        
-        for fmt in formats:
-            try:
-                parsed = datetime.strptime(date_str, fmt)
-                return parsed.strftime('%Y-%m-%d')
-            except ValueError:
-                continue
+        match = NUMERIC_DATE_RE.match(date_str)
+        if match:
+            first, _, second, last = match.groups()
+            if len(first) == 4:
+                # Year first: YYYY/MM/DD
+                candidates = [(int(first), int(second), int(last))] if len(last) <= 2 else []
+            elif len(last) in (2, 4) and len(first) <= 2:
+                year = int(last)
+                if len(last) == 2:
+                    # Same pivot as strptime's %y
+                    year += 2000 if year < 69 else 1900
+                # Day first, as Indian reports write it; month first if that cannot be a date
+                candidates = [(year, int(second), int(first)), (year, int(first), int(second))]
+            else:
+                candidates = []
+            for year, month, day in candidates:
+                if 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]:
+                    return f"{year:04d}-{month:02d}-{day:02d}"
+        else:
+            for fmt in TEXT_DATE_FORMATS:
+                try:
+                    return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
+                except ValueError:
+                    continue
         
-        # If no format matches, return current date
-        return datetime.now().strftime('%Y-%m-%d')
+        # No format matches
+        return None
     
-    def _extract_named_entities(self, text: str) -> List[Dict[str, Any]]:
-        """Extract named entities using spaCy"""
+    async def _extract_named_entities(self, text: str) -> List[Dict[str, Any]]:
+        """Extract named entities using spaCy, batched with other documents"""
         if not self.nlp:
             return []
         
-        try:
-            doc = self.nlp(text)
-            entities = []
+        if self._ner_worker is None or self._ner_worker.done():
+            self._ner_queue = asyncio.Queue()
+            self._ner_worker = asyncio.create_task(self._run_ner_batches())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._ner_queue.put((text, future))
+        return await future
+    
+    async def _run_ner_batches(self) -> None:
+        """Take queued documents in batches and run each batch in a thread"""
+        while True:
+            batch = [await self._ner_queue.get()]
+            while len(batch) < NER_BATCH_SIZE and not self._ner_queue.empty():
+                batch.append(self._ner_queue.get_nowait())
             
-            for ent in doc.ents:
-                if ent.label_ in ['ORG', 'PERSON', 'DATE', 'CARDINAL', 'QUANTITY']:
-                    entities.append({
-                        'text': ent.text,
-                        'label': ent.label_,
-                        'start': ent.start_char,
-                        'end': ent.end_char,
-                        'confidence': 0.8  # spaCy doesn't provide confidence scores
-                    })
+            # Callers that gave up are not worth the inference
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
             
-            return entities
-        except Exception as e:
-            logger.warning(f"Error extracting named entities: {e}")
-            return []
+            try:
+                results = await asyncio.to_thread(self._entities_for_batch, [text for text, _ in batch])
+            except Exception as e:
+                logger.warning("Error extracting named entities: %s", e)
+                results = [[] for _ in batch]
+            
+            for (_, future), entities in zip(batch, results):
+                if not future.done():
+                    future.set_result(entities)
     
-    def _calculate_confidence(self, biomarkers: Dict, text: str) -> float:
-        """Calculate overall confidence score for the extraction"""
+    def _entities_for_batch(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """Synchronous NER over several documents with one nlp.pipe call"""
+        return [
+            [
+                {
+                    'text': ent.text,
+                    'label': ent.label_,
+                    'start': ent.start_char,
+                    'end': ent.end_char,
+                    'confidence': 0.8  # spaCy doesn't provide confidence scores
+                }
+                for ent in doc.ents
+                if ent.label_ in ENTITY_LABELS
+            ]
+            for doc in self.nlp.pipe(texts, batch_size=NER_BATCH_SIZE)
+        ]
+    
+    def _calculate_confidence(self, biomarkers: Dict, cleaned_text: str) -> float:
+        """Calculate overall confidence score for the extraction from the cleaned, lower-cased text"""
         if not biomarkers:
             return 0.0
         
@@ -482,14 +746,14 @@ class NLPService:
         biomarker_score = min(len(biomarkers) * 0.2, 1.0)
         
         # Text quality indicators
-        text_length_score = min(len(text) / 1000, 1.0)
+        text_length_score = min(len(cleaned_text) / 1000, 1.0)
         
         # Check for medical keywords
-        medical_keywords = [
-            'test', 'result', 'normal', 'abnormal', 'range', 
-            'laboratory', 'clinic', 'hospital', 'doctor', 'patient'
-        ]
-        keyword_score = sum(1 for keyword in medical_keywords if keyword in text.lower()) / len(medical_keywords)
+        if KEYWORD_AUTOMATON is not None:
+            found = {keyword for _, keyword in KEYWORD_AUTOMATON.iter(cleaned_text)}
+        else:
+            found = {keyword for keyword in MEDICAL_KEYWORDS if keyword in cleaned_text}
+        keyword_score = len(found) / len(MEDICAL_KEYWORDS)
         
         # Weighted average
         confidence = (biomarker_score * 0.5 + text_length_score * 0.2 + keyword_score * 0.3)
@@ -506,7 +770,7 @@ class NLPService:
             'entities': [],
             'confidence_score': 0.0,
             'text_length': 0,
-            'processed_at': datetime.utcnow().isoformat()
+            'processed_at': _utc_now_iso()
         }
     
     async def validate_biomarker_data(self, biomarkers: Dict[str, Dict]) -> Dict[str, Any]:
@@ -1,63 +1,180 @@
 from google.cloud import vision
-from google.cloud import storage
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
 import io
 import logging
 from typing import Dict, List, Optional, Tuple
 import asyncio
-from functools import wraps
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
 
 from app.config import settings
 
+# pyahocorasick (pip install pyahocorasick) finds every document type term in
+# one pass over the text; plain substring checks are used without it
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
-def async_wrap(func):
-    """Decorator to wrap synchronous functions to run in executor"""
+# Synchronous Vision file requests take at most 5 pages, so longer PDFs are
+# sent as several requests that run concurrently
+PDF_PAGES_PER_REQUEST = 5
+MAX_PDF_PAGES = 20
+
+# Vision reads lab reports as well at 1600 px and JPEG quality 85 as at
+# larger sizes, and the request is a fraction of the bytes
+PREPROCESS_MAX_SIZE = 1600
+PREPROCESS_JPEG_QUALITY = 85
+# Past this downscale factor LANCZOS costs several times BILINEAR for no
+# difference in the text read
+BILINEAR_DOWNSCALE_FACTOR = 2
+# Photos of printed reports whose channels differ by less than this on
+# average are sent as grayscale
+GRAYSCALE_MAX_CHANNEL_DIFF = 3
+
+# The Vision channel lives as long as the process and can sit idle between
+# uploads; keepalive pings stop load balancers from silently dropping it,
+# so the next upload does not pay for a new connection. The message size
+# limits are the ones the generated transport sets by default.
+VISION_CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+]
+
+# Terms that identify a document type, in priority order
+DOCUMENT_TYPE_TERMS = {
+    "Blood Test": ('hemoglobin', 'hb', 'rbc', 'wbc', 'platelet'),
+    "Lipid Panel": ('cholesterol', 'ldl', 'hdl', 'triglyceride'),
+    "Liver Function Test": ('liver', 'alt', 'ast', 'sgpt', 'sgot', 'bilirubin'),
+    "Diabetes Test": ('glucose', 'sugar', 'hba1c', 'diabetes'),
+    "Thyroid Function Test": ('thyroid', 'tsh', 't3', 't4'),
+    "Kidney Function Test": ('kidney', 'creatinine', 'urea', 'bun'),
+}
+DOCUMENT_TYPE_ORDER = list(DOCUMENT_TYPE_TERMS)
+
+
+def _build_document_type_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for priority, terms in enumerate(DOCUMENT_TYPE_TERMS.values()):
+        for term in terms:
+            # Keep the highest priority if a term is shared between types
+            existing = automaton.get(term, priority)
+            automaton.add_word(term, min(existing, priority))
+    automaton.make_automaton()
+    return automaton
+
+
+DOCUMENT_TYPE_AUTOMATON = _build_document_type_automaton()
+
+
+def is_pdf(content: bytes) -> bool:
+    return content[:5] == b"%PDF-"
+
+# Pillow releases the GIL while decoding, resizing and encoding, so image
+# preprocessing gets its own pool of one thread per core. Vision calls,
+# which mostly wait on the network, keep the loop's default executor and
+# never queue behind a resize.
+PREPROCESS_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ocr-preprocess")
+
+
+def async_wrap(func=None, *, executor=None):
+    """Decorator to wrap synchronous functions to run in executor.
+
+    Without an executor this is asyncio.to_thread on the default executor.
+    """
+    if func is None:
+        return partial(async_wrap, executor=executor)
+    
+    if executor is None:
+        @wraps(func)
+        async def run(*args, **kwargs):
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return run
+    
     @wraps(func)
-    async def run(*args, **kwargs):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
-    return run
+    async def run_in(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+    return run_in
 
 class OCRService:
     def __init__(self):
-        self.vision_client = vision.ImageAnnotatorClient()
-        self.storage_client = storage.Client()
+        transport_class = vision.ImageAnnotatorClient.get_transport_class("grpc")
+        channel = transport_class.create_channel(options=VISION_CHANNEL_OPTIONS)
+        self.vision_client = vision.ImageAnnotatorClient(transport=transport_class(channel=channel))
     
     async def extract_document_data(self, image_content: bytes) -> Dict:
         """Extract data from document using OCR"""
         try:
+            if is_pdf(image_content):
+                input_config = vision.InputConfig(content=image_content, mime_type="application/pdf")
+                full_text, confidence, pages = await self._extract_pdf_text(input_config)
+                return await self._document_result(full_text, confidence, pages)
+            
             # Preprocess image
             processed_content = await self.preprocess_image(image_content)
             
             # Extract text
             full_text, confidence = await self.extract_text_from_image(processed_content)
             
-            if not full_text:
-                logger.warning("No text extracted from document")
-                return {
-                    'raw_text': '',
-                    'confidence': 0.0,
-                    'pages': 0,
-                    'blocks': []
-                }
+            return await self._document_result(full_text, confidence)
             
-            # Detect document type
-            doc_type = await self.detect_document_type(full_text)
+        except Exception as e:
+            logger.error(f"Error extracting document data: {str(e)}")
+            raise e
+    
+    async def extract_document_data_from_uri(self, gcs_uri: str) -> Dict:
+        """Extract data from a document already in Cloud Storage.
+
+        Vision reads the object itself, so the bytes never pass through this
+        process; the image is sent as stored, without preprocessing.
+        """
+        try:
+            if gcs_uri.lower().endswith(".pdf"):
+                input_config = vision.InputConfig(
+                    gcs_source=vision.GcsSource(uri=gcs_uri), mime_type="application/pdf"
+                )
+                full_text, confidence, pages = await self._extract_pdf_text(input_config)
+                return await self._document_result(full_text, confidence, pages)
             
-            return {
-                'raw_text': full_text,
-                'confidence': confidence,
-                'document_type': doc_type,
-                'pages': 1,
-                'blocks': [],
-                'text_length': len(full_text)
-            }
+            image = vision.Image(source=vision.ImageSource(image_uri=gcs_uri))
+            full_text, confidence = await self._detect_text(image)
+            return await self._document_result(full_text, confidence)
             
         except Exception as e:
-            logger.error(f"Error extracting document data: {str(e)}")
+            logger.error(f"Error extracting document data from {gcs_uri}: {str(e)}")
             raise e
     
+    async def _document_result(self, full_text: str, confidence: float, pages: int = 1) -> Dict:
+        """Shape OCR output the way the upload pipeline expects it"""
+        if not full_text:
+            logger.warning("No text extracted from document")
+            return {
+                'raw_text': '',
+                'confidence': 0.0,
+                'pages': 0,
+                'blocks': []
+            }
+        
+        # Detect document type
+        doc_type = await self.detect_document_type(full_text)
+        
+        return {
+            'raw_text': full_text,
+            'confidence': confidence,
+            'document_type': doc_type,
+            'pages': pages,
+            'blocks': [],
+            'text_length': len(full_text)
+        }
+    
     async def extract_text_from_image(self, image_content: bytes) -> Tuple[str, float]:
         """Extract text from image using Google Cloud Vision API"""
         try:
@@ -69,40 +186,89 @@ class OCRService:
             logger.error(f"OCR error: {str(e)}")
             raise e
     
+    async def _call_vision_api(self, image_content: bytes) -> Tuple[str, float]:
+        """Run text detection on in-memory image bytes"""
+        return await self._detect_text(vision.Image(content=image_content))
+    
     @async_wrap
-    def _call_vision_api(self, image_content: bytes) -> Tuple[str, float]:
+    def _detect_text(self, image: vision.Image) -> Tuple[str, float]:
         """Synchronous wrapper for Vision API call"""
-        image = vision.Image(content=image_content)
-        
         # Perform OCR
-        response = self.vision_client.text_detection(image=image)
-        texts = response.text_annotations
-        
-        if not texts:
-            return "", 0.0
-        
-        # Get full text (first annotation contains all text)
-        full_text = texts[0].description
-        
-        # Calculate average confidence
-        confidence = self._calculate_confidence(texts[1:])  # Skip first (full text)
+        response = self.vision_client.document_text_detection(image=image)
         
         if response.error.message:
             raise Exception(f"OCR API error: {response.error.message}")
         
+        annotation = response.full_text_annotation
+        if not annotation.text:
+            return "", 0.0
+        
+        # Average of the per-page confidences Vision reports
+        confidence = self._calculate_confidence(annotation.pages)
+        
         logger.info(f"OCR completed with confidence: {confidence}")
-        return full_text, confidence
+        return annotation.text, confidence
     
     async def extract_text_from_pdf(self, pdf_content: bytes) -> Tuple[str, float]:
         """Extract text from PDF using Google Cloud Vision API"""
         try:
-            # For MVP, we'll treat PDF as image
-            # In production, you'd use Document AI for better PDF processing
-            return await self.extract_text_from_image(pdf_content)
+            input_config = vision.InputConfig(content=pdf_content, mime_type="application/pdf")
+            full_text, confidence, _ = await self._extract_pdf_text(input_config)
+            return full_text, confidence
         except Exception as e:
             logger.error(f"PDF OCR error: {str(e)}")
             raise e
     
+    async def _extract_pdf_text(self, input_config: vision.InputConfig) -> Tuple[str, float, int]:
+        """OCR a PDF page by page; returns its text, confidence and pages read.
+
+        The first page is read alone to learn the page count; the remaining
+        pages, up to MAX_PDF_PAGES, are then read in concurrent requests.
+        """
+        texts, confidences, total_pages = await self._annotate_pdf_pages(input_config, [1])
+        last_page = min(total_pages, MAX_PDF_PAGES)
+        if total_pages > MAX_PDF_PAGES:
+            logger.warning(f"PDF has {total_pages} pages, reading the first {MAX_PDF_PAGES}")
+        
+        page_groups = [
+            list(range(first, min(first + PDF_PAGES_PER_REQUEST, last_page + 1)))
+            for first in range(2, last_page + 1, PDF_PAGES_PER_REQUEST)
+        ]
+        for group_texts, group_confidences, _ in await asyncio.gather(
+            *(self._annotate_pdf_pages(input_config, group) for group in page_groups)
+        ):
+            texts.extend(group_texts)
+            confidences.extend(group_confidences)
+        
+        full_text = "\n\n".join(text for text in texts if text)
+        confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        logger.info(f"PDF OCR completed for {last_page} pages with confidence: {confidence}")
+        return full_text, confidence, last_page
+    
+    @async_wrap
+    def _annotate_pdf_pages(
+        self, input_config: vision.InputConfig, pages: List[int]
+    ) -> Tuple[List[str], List[float], int]:
+        """Synchronous Vision file request for the given 1-based pages"""
+        request = vision.AnnotateFileRequest(
+            input_config=input_config,
+            features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+            pages=pages
+        )
+        response = self.vision_client.batch_annotate_files(requests=[request])
+        file_response = response.responses[0]
+        if file_response.error.message:
+            raise Exception(f"OCR API error: {file_response.error.message}")
+        
+        texts, confidences = [], []
+        for page_response in file_response.responses:
+            if page_response.error.message:
+                raise Exception(f"OCR API error: {page_response.error.message}")
+            annotation = page_response.full_text_annotation
+            texts.append(annotation.text)
+            confidences.extend(page.confidence for page in annotation.pages)
+        return texts, confidences, file_response.total_pages
+    
     async def preprocess_image(self, image_content: bytes) -> bytes:
         """Preprocess image for better OCR results"""
         try:
@@ -113,57 +279,63 @@ class OCRService:
             logger.error(f"Image preprocessing error: {str(e)}")
             return image_content  # Return original if preprocessing fails
     
-    @async_wrap
+    @async_wrap(executor=PREPROCESS_EXECUTOR)
     def _preprocess_sync(self, image_content: bytes) -> bytes:
         """Synchronous image preprocessing"""
         # Open image with PIL
         image = Image.open(io.BytesIO(image_content))
         
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
+        # Opening only reads the header; a JPEG Vision can take as it is
+        # is sent without being decoded and re-encoded
+        if image.format == 'JPEG' and image.mode in ('RGB', 'L') and max(image.size) <= PREPROCESS_MAX_SIZE:
+            return image_content
+        
+        # Convert to RGB if necessary; grayscale scans stay single channel
+        if image.mode not in ('RGB', 'L'):
             image = image.convert('RGB')
         
         # Resize if too large (maintain aspect ratio)
-        max_size = 2048
-        if max(image.size) > max_size:
-            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        scale = max(image.size) / PREPROCESS_MAX_SIZE
+        if scale > 1:
+            resample = Image.Resampling.BILINEAR if scale > BILINEAR_DOWNSCALE_FACTOR else Image.Resampling.LANCZOS
+            image.thumbnail((PREPROCESS_MAX_SIZE, PREPROCESS_MAX_SIZE), resample)
         
-        # Save processed image
+        if image.mode == 'RGB' and self._is_monochrome(image):
+            image = image.convert('L')
+        
+        # Save processed image; EXIF and other metadata are not carried over
         output = io.BytesIO()
-        image.save(output, format='JPEG', quality=95, optimize=True)
+        image.save(output, format='JPEG', quality=PREPROCESS_JPEG_QUALITY, optimize=True)
         return output.getvalue()
     
-    def _calculate_confidence(self, word_annotations: List) -> float:
-        """Calculate average confidence from word annotations"""
-        if not word_annotations:
+    @staticmethod
+    def _is_monochrome(image: Image.Image) -> bool:
+        """Whether an RGB image is, up to sensor noise, shades of gray"""
+        red, green, blue = image.split()
+        diff = ImageStat.Stat(ImageChops.difference(red, green)).mean[0]
+        diff = max(diff, ImageStat.Stat(ImageChops.difference(green, blue)).mean[0])
+        return diff < GRAYSCALE_MAX_CHANNEL_DIFF
+    
+    def _calculate_confidence(self, pages: List) -> float:
+        """Average confidence over the annotated pages"""
+        if not pages:
             return 0.0
-        
-        total_confidence = 0.0
-        word_count = 0
-        
-        for annotation in word_annotations:
-            if hasattr(annotation, 'confidence'):
-                total_confidence += annotation.confidence
-                word_count += 1
-        
-        return total_confidence / word_count if word_count > 0 else 0.7  # Default reasonable confidence
+        return sum(page.confidence for page in pages) / len(pages)
     
     async def detect_document_type(self, text: str) -> str:
         """Detect document type based on extracted text"""
         text_lower = text.lower()
         
-        # Common medical test patterns
-        if any(term in text_lower for term in ['hemoglobin', 'hb', 'rbc', 'wbc', 'platelet']):
-            return "Blood Test"
-        elif any(term in text_lower for term in ['cholesterol', 'ldl', 'hdl', 'triglyceride']):
-            return "Lipid Panel"
-        elif any(term in text_lower for term in ['liver', 'alt', 'ast', 'sgpt', 'sgot', 'bilirubin']):
-            return "Liver Function Test"
-        elif any(term in text_lower for term in ['glucose', 'sugar', 'hba1c', 'diabetes']):
-            return "Diabetes Test"
-        elif any(term in text_lower for term in ['thyroid', 'tsh', 't3', 't4']):
-            return "Thyroid Function Test"
-        elif any(term in text_lower for term in ['kidney', 'creatinine', 'urea', 'bun']):
-            return "Kidney Function Test"
-        else:
-            return "Medical Report"
+        if DOCUMENT_TYPE_AUTOMATON is not None:
+            best = None
+            for _, priority in DOCUMENT_TYPE_AUTOMATON.iter(text_lower):
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+            return DOCUMENT_TYPE_ORDER[best] if best is not None else "Medical Report"
+        
+        for doc_type, terms in DOCUMENT_TYPE_TERMS.items():
+            if any(term in text_lower for term in terms):
+                return doc_type
+        return "Medical Report"
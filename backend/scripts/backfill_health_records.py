@@ -0,0 +1,76 @@
+"""
+One-off backfill for health records written before the soft-delete filter
+and the stats summary.
+
+Record queries filter on deleted == False, and Firestore never matches a
+missing field, so older records without the field drop out of every list
+and count. Stats summaries are seeded by counting records with
+all_normal == True. This sets deleted: False on each health_records
+document that lacks it, and derives status_histogram and all_normal from
+the biomarkers of records that lack those.
+
+Run from backend/ once, before deploying the filtered queries:
+
+    python -m scripts.backfill_health_records [--dry-run]
+"""
+import argparse
+import logging
+
+from google.cloud import firestore
+
+from app.config import settings
+from app.services.firestore_service import _biomarker_summary
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+BATCH_WRITE_LIMIT = 500
+
+
+def _missing_fields(record: dict) -> dict:
+    """Fields to add to a record written before they existed"""
+    fields = {}
+    if 'deleted' not in record:
+        fields['deleted'] = False
+    if 'all_normal' not in record or 'status_histogram' not in record:
+        fields.update(_biomarker_summary(record.get('biomarkers')))
+    return fields
+
+
+def backfill(db: firestore.Client, dry_run: bool = False) -> int:
+    """Add missing fields to older records; returns how many were (or would be) updated"""
+    batch = db.batch()
+    pending = 0
+    updated = 0
+    query = db.collection('health_records').select(['deleted', 'all_normal', 'status_histogram', 'biomarkers'])
+    for doc in query.stream():
+        fields = _missing_fields(doc.to_dict() or {})
+        if not fields:
+            continue
+        updated += 1
+        if dry_run:
+            continue
+        batch.update(doc.reference, fields)
+        pending += 1
+        if pending == BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help="count records to update without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    db = firestore.Client(project=settings.firebase_project_id)
+    updated = backfill(db, dry_run=args.dry_run)
+    logger.info("%s %s health records", "Would update" if args.dry_run else "Updated", updated)
+
+
+if __name__ == '__main__':
+    main()
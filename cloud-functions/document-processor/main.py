@@ -1,14 +1,23 @@
 import functions_framework
 from google.cloud import vision
 from google.cloud import firestore
-from google.cloud import storage
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.api_core.exceptions import AlreadyExists
 import logging
 import os
 import re
 import json
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
 from typing import Dict, Any, List
 
+# pyahocorasick (pip install pyahocorasick) finds all test type keywords in
+# one pass over the text; plain substring checks are used without it
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,7 +25,6 @@ logger = logging.getLogger(__name__)
 # Initialize clients
 vision_client = vision.ImageAnnotatorClient()
 firestore_client = firestore.Client()
-storage_client = storage.Client()
 
 # Biomarker patterns (simplified version of NLP service)
 BIOMARKER_PATTERNS = {
@@ -64,6 +72,95 @@ BIOMARKER_PATTERNS = {
     }
 }
 
+
+# Indexed by how many bands a value falls in: the borderline band contains
+# the normal band, so a normal value lands in both
+STATUS_BY_BANDS = ('abnormal', 'borderline', 'normal')
+
+
+def _make_biomarker_reader(value_index: int, unit_index, config: Dict[str, Any]):
+    """
+    Specialize the match -> biomarker conversion for one pattern. Unit,
+    range and band limits are bound once here instead of being looked up
+    in BIOMARKER_PATTERNS for every match.
+    """
+    default_unit = config['unit']
+    value_range = config['range']
+    low, high = config['min'], config['max']
+    border_low, border_high = low * 0.9, high * 1.1
+
+    def read(match) -> Dict[str, Any]:
+        value = float(match.group(value_index))
+        return {
+            'value': value,
+            'unit': match.group(unit_index) if unit_index else default_unit,
+            'range': value_range,
+            'status': STATUS_BY_BANDS[(border_low <= value <= border_high) + (low <= value <= high)]
+        }
+
+    return read
+
+
+def _build_biomarker_regex(patterns: Dict[str, Dict[str, Any]]):
+    """
+    Combine every biomarker pattern into one alternation so the text is
+    scanned once. Each pattern is wrapped in a named group; the returned
+    table maps that group name to (biomarker, reader for its match).
+    """
+    alternatives = []
+    groups = {}
+    offset = 1
+    for biomarker_name, config in patterns.items():
+        for i, pattern in enumerate(config['patterns']):
+            group_name = f"{biomarker_name}_{i}"
+            inner_groups = re.compile(pattern).groups
+            unit_index = offset + 2 if inner_groups > 1 else None
+            groups[group_name] = (biomarker_name, _make_biomarker_reader(offset + 1, unit_index, config))
+            # Names must start a word, so 'ldl' is not read out of 'vldl'
+            alternatives.append(f"(?P<{group_name}>\\b{pattern})")
+            offset += 1 + inner_groups
+    return re.compile('|'.join(alternatives)), groups
+
+
+BIOMARKER_RE, BIOMARKER_GROUPS = _build_biomarker_regex(BIOMARKER_PATTERNS)
+
+# Patterns used on every invocation, compiled once per instance. Text is
+# lower-cased before matching, so none of them need IGNORECASE.
+WS_RE = re.compile(r'\s+')
+FACILITY_RES = [
+    re.compile(r'(.*?(?:hospital|clinic|diagnostics|lab|laboratory).*?)(?:\n|$)', re.MULTILINE),
+]
+DATE_RES = [
+    re.compile(r'date\s*:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})'),
+    re.compile(r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})'),
+]
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%Y-%m-%d')
+
+# Test types in priority order; the first type with a keyword in the text wins
+TEST_TYPE_KEYWORDS = {
+    'Complete Blood Count': ['complete blood count', 'cbc', 'hemogram'],
+    'Lipid Panel': ['lipid profile', 'lipid panel', 'cholesterol'],
+    'Liver Function Test': ['liver function', 'lft', 'hepatic'],
+    'Blood Test': ['blood test', 'blood work']
+}
+TEST_TYPE_ORDER = list(TEST_TYPE_KEYWORDS)
+
+
+def _build_test_type_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for priority, keywords in enumerate(TEST_TYPE_KEYWORDS.values()):
+        for keyword in keywords:
+            # Keep the highest priority if a keyword is shared between types
+            existing = automaton.get(keyword, priority)
+            automaton.add_word(keyword, min(existing, priority))
+    automaton.make_automaton()
+    return automaton
+
+
+TEST_TYPE_AUTOMATON = _build_test_type_automaton()
+
 @functions_framework.cloud_event
 def process_document(cloud_event):
     """
@@ -93,21 +190,11 @@ def process_document(cloud_event):
             return
         
         user_id = path_parts[1]
+        gcs_uri = f"gs://{bucket_name}/{file_name}"
         
-        # Download the file from Cloud Storage
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
-        
-        if not blob.exists():
-            logger.error(f"File not found: {file_name}")
-            return
-        
-        # Download file content
-        file_content = blob.download_as_bytes()
-        
-        # Perform OCR
+        # Vision reads the object straight from Cloud Storage
         logger.info("Starting OCR processing...")
-        ocr_result = perform_ocr(file_content)
+        ocr_result = perform_ocr(gcs_uri)
         
         if not ocr_result['text']:
             logger.warning(f"No text extracted from {file_name}")
@@ -119,29 +206,47 @@ def process_document(cloud_event):
         
         # Create health record in Firestore
         logger.info("Creating health record in Firestore...")
+        # Same "Z" form the backend stores; created_at and updated_at are
+        # ordered and paginated as strings
+        now_iso = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        biomarkers = nlp_result.get('biomarkers', {})
+        # Denormalized so record stats are counted server-side, never rescanned
+        status_histogram = dict(Counter(b.get('status') or 'unknown' for b in biomarkers.values()))
         record_data = {
             'user_id': user_id,
-            'date': nlp_result.get('date', datetime.now().strftime('%Y-%m-%d')),
+            'date': nlp_result.get('date') or datetime.now().strftime('%Y-%m-%d'),
             'type': nlp_result.get('test_type', 'Medical Document'),
             'facility': nlp_result.get('facility', 'Unknown Facility'),
-            'biomarkers': nlp_result.get('biomarkers', {}),
+            'biomarkers': biomarkers,
+            'status_histogram': status_histogram,
+            'all_normal': status_histogram.keys() <= {'normal'},
+            'deleted': False,
             'original_document': file_name.split('/')[-1],
-            'document_url': f"gs://{bucket_name}/{file_name}",
+            'document_url': gcs_uri,
             'ocr_confidence': ocr_result.get('confidence', 0.0),
             'processing_metadata': {
-                'processed_at': datetime.utcnow().isoformat(),
+                'processed_at': now_iso,
                 'processor': 'cloud-function',
                 'ocr_pages': ocr_result.get('pages', 0),
                 'text_length': len(ocr_result.get('text', '')),
-                'biomarkers_found': len(nlp_result.get('biomarkers', {}))
+                'biomarkers_found': len(biomarkers)
             },
-            'created_at': datetime.utcnow().isoformat(),
-            'updated_at': datetime.utcnow().isoformat()
+            'created_at': now_iso,
+            'updated_at': now_iso
         }
         
-        # Save to Firestore
+        # Save to Firestore, together with the user's stats summary counters
         doc_ref = firestore_client.collection('health_records').document()
-        doc_ref.set(record_data)
+        stats_ref = firestore_client.collection('users').document(user_id).collection('stats').document('summary')
+        ensure_stats_summary(stats_ref, user_id)
+        batch = firestore_client.batch()
+        batch.set(doc_ref, record_data)
+        batch.set(stats_ref, {
+            'total_records': firestore.Increment(1),
+            'normal_results': firestore.Increment(1 if record_data['all_normal'] else 0),
+            'type_counts': {record_data['type'] or 'Unknown': firestore.Increment(1)}
+        }, merge=True)
+        batch.commit()
         
         logger.info(f"Health record created: {doc_ref.id}")
         
@@ -163,18 +268,49 @@ def process_document(cloud_event):
         }
 
 
-def perform_ocr(image_bytes: bytes) -> Dict[str, Any]:
+def ensure_stats_summary(stats_ref, user_id: str) -> None:
+    """
+    Seed a user's stats summary from their live records if it does not exist.
+
+    Without a seed, the first increment would start the summary from zero
+    and records written before it existed would never be counted. Call this
+    before writing the record; create() fails if another writer seeded the
+    summary first, so no record is counted twice.
+    """
+    if stats_ref.get(field_paths=['total_records']).exists:
+        return
+    
+    live_records = firestore_client.collection('health_records').where(
+        filter=FieldFilter('user_id', '==', user_id)
+    ).where(
+        filter=FieldFilter('deleted', '==', False)
+    )
+    total = live_records.count(alias='total').get()
+    normal = live_records.where(filter=FieldFilter('all_normal', '==', True)).count(alias='total').get()
+    type_counts = Counter(doc.to_dict().get('type') or 'Unknown' for doc in live_records.select(['type']).stream())
+    try:
+        stats_ref.create({
+            'total_records': int(total[0][0].value),
+            'normal_results': int(normal[0][0].value),
+            'type_counts': dict(type_counts)
+        })
+    except AlreadyExists:
+        pass
+
+
+def perform_ocr(gcs_uri: str) -> Dict[str, Any]:
     """
     Perform OCR on image using Google Cloud Vision API
     
     Args:
-        image_bytes: Image content as bytes
+        gcs_uri: gs:// URI of the image; Vision fetches it directly, and a
+            missing object comes back as a Vision API error
         
     Returns:
         Dictionary with extracted text and metadata
     """
     try:
-        image = vision.Image(content=image_bytes)
+        image = vision.Image(source=vision.ImageSource(image_uri=gcs_uri))
         
         # Perform document text detection
         response = vision_client.document_text_detection(image=image)
@@ -212,24 +348,13 @@ def perform_ocr(image_bytes: bytes) -> Dict[str, Any]:
 
 def calculate_ocr_confidence(response) -> float:
     """Calculate overall confidence score from OCR response"""
-    try:
-        if not response.text_annotations or len(response.text_annotations) < 2:
-            return 0.0
-        
-        total_confidence = 0.0
-        count = 0
-        
-        # Skip first annotation (full text)
-        for annotation in response.text_annotations[1:]:
-            if hasattr(annotation, 'confidence'):
-                total_confidence += annotation.confidence
-                count += 1
-        
-        return total_confidence / count if count > 0 else 0.5
-        
-    except Exception as e:
-        logger.warning(f"Error calculating confidence: {e}")
-        return 0.5
+    pages = response.full_text_annotation.pages
+    if not pages:
+        return 0.0
+    
+    # Document text detection reports a confidence per page, so there is
+    # no need to walk every word annotation
+    return sum(page.confidence for page in pages) / len(pages)
 
 
 def extract_biomarkers(text: str) -> Dict[str, Any]:
@@ -245,32 +370,19 @@ def extract_biomarkers(text: str) -> Dict[str, Any]:
     try:
         # Clean text
         cleaned_text = text.lower()
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+        cleaned_text = WS_RE.sub(' ', cleaned_text)
         
         # Extract biomarkers
         biomarkers = {}
         
-        for biomarker_name, config in BIOMARKER_PATTERNS.items():
-            for pattern in config['patterns']:
-                matches = re.finditer(pattern, cleaned_text, re.IGNORECASE)
-                
-                for match in matches:
-                    try:
-                        value = float(match.group(1))
-                        unit = match.group(2) if len(match.groups()) > 1 else config['unit']
-                        
-                        status = determine_status(value, config['min'], config['max'])
-                        
-                        biomarkers[biomarker_name] = {
-                            'value': value,
-                            'unit': unit,
-                            'range': config['range'],
-                            'status': status
-                        }
-                        
-                        break  # Use first match
-                    except (ValueError, IndexError):
-                        continue
+        for match in BIOMARKER_RE.finditer(cleaned_text):
+            biomarker_name, read = BIOMARKER_GROUPS[match.lastgroup]
+            if biomarker_name in biomarkers:
+                continue  # Use first match
+            try:
+                biomarkers[biomarker_name] = read(match)
+            except (ValueError, TypeError):
+                continue
         
         # Extract test type
         test_type = extract_test_type(cleaned_text)
@@ -302,26 +414,18 @@ def extract_biomarkers(text: str) -> Dict[str, Any]:
         }
 
 
-def determine_status(value: float, min_normal: float, max_normal: float) -> str:
-    """Determine if value is normal, borderline, or abnormal"""
-    if min_normal <= value <= max_normal:
-        return 'normal'
-    elif (min_normal * 0.9) <= value <= (max_normal * 1.1):
-        return 'borderline'
-    else:
-        return 'abnormal'
-
-
 def extract_test_type(text: str) -> str:
-    """Extract test type from text"""
-    test_types = {
-        'Complete Blood Count': ['complete blood count', 'cbc', 'hemogram'],
-        'Lipid Panel': ['lipid profile', 'lipid panel', 'cholesterol'],
-        'Liver Function Test': ['liver function', 'lft', 'hepatic'],
-        'Blood Test': ['blood test', 'blood work']
-    }
-    
-    for test_type, keywords in test_types.items():
+    """Extract test type from lower-cased text"""
+    if TEST_TYPE_AUTOMATON is not None:
+        best = None
+        for _, priority in TEST_TYPE_AUTOMATON.iter(text):
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return TEST_TYPE_ORDER[best] if best is not None else 'Medical Test'
+
+    for test_type, keywords in TEST_TYPE_KEYWORDS.items():
         if any(keyword in text for keyword in keywords):
             return test_type
     
@@ -329,13 +433,9 @@ def extract_test_type(text: str) -> str:
 
 
 def extract_facility(text: str) -> str:
-    """Extract medical facility name"""
-    patterns = [
-        r'(.*?(?:hospital|clinic|diagnostics|lab|laboratory).*?)(?:\n|$)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+    """Extract medical facility name from lower-cased text"""
+    for pattern in FACILITY_RES:
+        match = pattern.search(text)
         if match:
             facility = match.group(1).strip()
             if 5 < len(facility) < 100:
@@ -345,14 +445,9 @@ def extract_facility(text: str) -> str:
 
 
 def extract_date(text: str) -> str:
-    """Extract test date from text"""
-    date_patterns = [
-        r'date\s*:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-        r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    """Extract test date from lower-cased text"""
+    for pattern in DATE_RES:
+        match = pattern.search(text)
         if match:
             try:
                 date_str = match.group(1)
@@ -366,11 +461,7 @@ def extract_date(text: str) -> str:
 
 def parse_date(date_str: str) -> str:
     """Parse date string to standard format"""
-    from datetime import datetime
-    
-    formats = ['%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%Y-%m-%d']
-    
-    for fmt in formats:
+    for fmt in DATE_FORMATS:
         try:
             parsed = datetime.strptime(date_str, fmt)
             return parsed.strftime('%Y-%m-%d')
@@ -73,13 +73,19 @@ export interface ApiResponse<T> {
 
 export interface UploadResponse {
   record_id: string;
-  record: HealthRecord;
-  processing_summary: {
-    ocr_confidence: number;
-    biomarkers_extracted: number;
-    text_length: number;
-    processing_time: string;
-  };
+  status: 'processing';
+  document_url: string;
+  status_url: string;
+}
+
+export interface UploadStatus {
+  record_id: string;
+  status: 'processing' | 'completed' | 'failed';
+  error?: string | null;
+  ocr_confidence: number;
+  biomarkers_count: number;
+  processed_at?: string;
+  document_url?: string;
 }
 
 export interface UserStats {